@@ -1,13 +1,13 @@
 # backend/app.py
-import os
+import json
 import uuid
-from flask import Flask, render_template, request, jsonify
-from dotenv import load_dotenv
-from gemini_client import GeminiClient
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from gemini_client import GeminiClient, init_env
+from log_config import setup_logging
 
 # Load environment variables from .env file in the backend directory
-env_path = os.path.join(os.path.dirname(__file__), '.env')
-load_dotenv(env_path)
+init_env()
+setup_logging()
 
 app = Flask(__name__, template_folder="../templates")
 app.secret_key = "your-secret-key-change-in-production"  # Change this in production
@@ -48,6 +48,31 @@ def chat():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """Stream the response to a chat message as server-sent events."""
+    data = request.get_json() or {}
+    user_message = data.get("message", "")
+    session_id = data.get("session_id") or str(uuid.uuid4())
+
+    if not user_message:
+        return jsonify({"error": "Message is required"}), 400
+
+    def generate():
+        try:
+            for chunk in gemini_client.chat_stream(user_message, session_id=session_id):
+                yield f"data: {json.dumps({'text': chunk})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"X-Session-Id": session_id, "Cache-Control": "no-cache"}
+    )
+
+
 @app.route("/api/reset", methods=["POST"])
 def reset():
     """Reset the conversation history."""
@@ -1,13 +1,37 @@
 # backend/database.py
+import atexit
+import functools
+import logging
 import os
-from typing import List, Dict, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from supabase import create_client, Client
-from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-# Load environment variables from .env file in the backend directory
-env_path = os.path.join(os.path.dirname(__file__), '.env')
-load_dotenv(env_path)
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_supabase_client(supabase_url: str, supabase_key: str) -> Client:
+    """Create the Supabase client once and share its HTTP pool across sessions."""
+    return create_client(supabase_url, supabase_key)
+
+
+# Shared by every SupabaseDB so each Streamlit session doesn't start its own threads.
+# Background writer so non-critical inserts don't block the caller
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="supabase-writer")
+# Reader pool used to overlap independent SELECTs
+_reader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="supabase-reader")
+# Let queued writes finish before the process exits
+atexit.register(_writer.shutdown, wait=True)
+
+# session_id -> conversation_id, shared by every SupabaseDB since each Streamlit
+# session builds its own; bounded LRU so long-running processes don't grow it forever
+SESSION_CACHE_SIZE = 1024
+_session_cache: "OrderedDict[str, str]" = OrderedDict()
+_session_cache_lock = threading.Lock()
 
 
 class SupabaseDB:
@@ -26,11 +50,13 @@ class SupabaseDB:
         # Initialize Supabase client as per official documentation
         # Reference: https://supabase.com/docs/reference/python/initializing
         try:
-            self.client: Client = create_client(supabase_url, supabase_key)
+            self.client: Client = _get_supabase_client(supabase_url, supabase_key)
             self.conversations_table = "conversations"
             self.messages_table = "messages"
             self.roadmaps_table = "roadmaps"
             self.roadmap_items_table = "roadmap_items"
+            self._writer = _writer
+            self._reader = _reader
         except Exception as e:
             raise ConnectionError(
                 f"Failed to initialize Supabase client: {str(e)}. "
@@ -40,10 +66,11 @@ class SupabaseDB:
     def create_conversation(self, session_id: str) -> Optional[str]:
         """Create a new conversation record and return conversation ID."""
         try:
+            now = datetime.now(timezone.utc).isoformat()
             response = self.client.table(self.conversations_table).insert({
                 "session_id": session_id,
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
+                "created_at": now,
+                "updated_at": now
             }).execute()
             
             # Check if response has data
@@ -57,70 +84,119 @@ class SupabaseDB:
                 # Error message is handled in get_or_create_conversation to avoid duplicates
                 return None
             else:
-                print(f"Error creating conversation: {e}")
+                logger.error("Error creating conversation: %s", e)
                 if hasattr(e, 'message'):
-                    print(f"Error message: {e.message}")
+                    logger.error("Error message: %s", e.message)
             return None
 
     def get_or_create_conversation(self, session_id: str) -> Optional[str]:
         """Get existing conversation ID or create a new one."""
+        # A session maps to one conversation for the lifetime of the process
+        with _session_cache_lock:
+            conversation_id = _session_cache.get(session_id)
+            if conversation_id is not None:
+                _session_cache.move_to_end(session_id)
+                return conversation_id
+
         try:
-            # Try to find existing conversation
-            # Using order by created_at descending to get the most recent
-            response = self.client.table(self.conversations_table)\
-                .select("id")\
-                .eq("session_id", session_id)\
-                .order("created_at", desc=True)\
-                .limit(1)\
-                .execute()
-            
-            if response.data and len(response.data) > 0:
-                return response.data[0].get("id")
-            
-            # Create new conversation if not found
-            return self.create_conversation(session_id)
+            try:
+                # Create the conversation or touch the existing one in a single round-trip
+                response = self.client.table(self.conversations_table)\
+                    .upsert({
+                        "session_id": session_id,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }, on_conflict="session_id")\
+                    .execute()
+                conversation_id = response.data[0].get("id") if response.data else None
+            except Exception as e:
+                error_msg = str(e)
+                # Databases created before session_id was made unique can't upsert on it
+                if "42P10" not in error_msg and "no unique or exclusion constraint" not in error_msg:
+                    raise
+                conversation_id = self._find_or_create_conversation(session_id)
+
+            if conversation_id:
+                with _session_cache_lock:
+                    _session_cache[session_id] = conversation_id
+                    _session_cache.move_to_end(session_id)
+                    if len(_session_cache) > SESSION_CACHE_SIZE:
+                        _session_cache.popitem(last=False)
+            return conversation_id
         except Exception as e:
             error_msg = str(e)
             # Check if it's a table not found error - suppress repeated errors
             if "PGRST205" in error_msg or "Could not find the table" in error_msg:
                 # Only show error once using a class variable
                 if not hasattr(self, '_table_error_shown'):
-                    print("\n" + "="*70)
-                    print("⚠️  DATABASE SETUP REQUIRED")
-                    print("="*70)
-                    print("The Supabase tables have not been created yet.")
-                    print("\nTo fix this:")
-                    print("1. Go to your Supabase project dashboard")
-                    print("2. Navigate to SQL Editor")
-                    print("3. Run the SQL script from: supabase_schema.sql")
-                    print("4. The script will create the 'conversations' and 'messages' tables")
-                    print("\nThe app will continue to work without database persistence.")
-                    print("(This message will only show once)")
-                    print("="*70 + "\n")
+                    logger.warning(
+                        "\n" + "=" * 70 + "\n"
+                        "⚠️  DATABASE SETUP REQUIRED\n"
+                        + "=" * 70 + "\n"
+                        "The Supabase tables have not been created yet.\n"
+                        "\nTo fix this:\n"
+                        "1. Go to your Supabase project dashboard\n"
+                        "2. Navigate to SQL Editor\n"
+                        "3. Run the SQL script from: supabase_schema.sql\n"
+                        "4. The script will create the 'conversations' and 'messages' tables\n"
+                        "\nThe app will continue to work without database persistence.\n"
+                        "(This message will only show once)\n"
+                        + "=" * 70
+                    )
                     self._table_error_shown = True
                 # Return None silently - app will work without database
                 return None
             else:
                 # Other errors - log them
-                print(f"Error getting/creating conversation: {e}")
+                logger.error("Error getting/creating conversation: %s", e)
                 if hasattr(e, 'message'):
-                    print(f"Error message: {e.message}")
+                    logger.error("Error message: %s", e.message)
             return None
 
+    def _find_or_create_conversation(self, session_id: str) -> Optional[str]:
+        """Look up the latest conversation for a session, creating one if none exists."""
+        # Using order by created_at descending to get the most recent
+        response = self.client.table(self.conversations_table)\
+            .select("id")\
+            .eq("session_id", session_id)\
+            .order("created_at", desc=True)\
+            .limit(1)\
+            .execute()
+
+        if response.data and len(response.data) > 0:
+            return response.data[0].get("id")
+
+        # Create new conversation if not found
+        return self.create_conversation(session_id)
+
     def save_message(self, conversation_id: str, role: str, content: str) -> bool:
         """Save a message to the database."""
+        return self.save_messages_bulk(conversation_id, [(role, content)])
+
+    def save_messages_bulk(self, conversation_id: str, messages: List[Tuple[str, str]]) -> bool:
+        """Save several (role, content) messages in one insert."""
+        if not messages:
+            return True
         try:
-            self.client.table(self.messages_table).insert({
-                "conversation_id": conversation_id,
-                "role": role,
-                "content": content,
-                "created_at": datetime.utcnow().isoformat()
-            }).execute()
+            # Step each timestamp by a microsecond so history keeps the insert order
+            now = datetime.now(timezone.utc)
+            self.client.table(self.messages_table).insert([
+                {
+                    "conversation_id": conversation_id,
+                    "role": role,
+                    "content": content,
+                    "created_at": (now + timedelta(microseconds=offset)).isoformat()
+                }
+                for offset, (role, content) in enumerate(messages)
+            ]).execute()
             return True
         except Exception as e:
-            print(f"Error saving message: {e}")
+            logger.error("Error saving messages: %s", e)
             return False
 
+    def save_messages_bulk_async(self, conversation_id: str, messages: List[Tuple[str, str]]) -> Future:
+        """Save several messages on the background writer and return immediately."""
+        return self._writer.submit(self.save_messages_bulk, conversation_id, messages)
+
     def get_conversation_history(self, conversation_id: str) -> List[Dict[str, str]]:
         """Retrieve conversation history from database."""
         try:
@@ -141,9 +217,9 @@ class SupabaseDB:
                 ]
             return []
         except Exception as e:
-            print(f"Error retrieving conversation history: {e}")
+            logger.error("Error retrieving conversation history: %s", e)
             if hasattr(e, 'message'):
-                print(f"Error message: {e.message}")
+                logger.error("Error message: %s", e.message)
             return []
 
     def clear_conversation(self, conversation_id: str) -> bool:
@@ -155,18 +231,74 @@ class SupabaseDB:
                 .execute()
             return True
         except Exception as e:
-            print(f"Error clearing conversation: {e}")
+            logger.error("Error clearing conversation: %s", e)
             return False
 
+    def get_conversation_summary(self, conversation_id: str) -> Tuple[str, int]:
+        """Return a conversation's rolling summary and how many messages it covers."""
+        try:
+            response = self.client.table(self.conversations_table)\
+                .select("summary, summary_message_count")\
+                .eq("id", conversation_id)\
+                .limit(1)\
+                .execute()
+
+            if response.data:
+                row = response.data[0]
+                return row.get("summary") or "", row.get("summary_message_count") or 0
+            return "", 0
+        except Exception as e:
+            logger.error("Error retrieving conversation summary: %s", e)
+            return "", 0
+
+    def update_conversation_summary(self, conversation_id: str, summary: str, message_count: int) -> bool:
+        """Store a conversation's rolling summary."""
+        try:
+            self.client.table(self.conversations_table)\
+                .update({
+                    "summary": summary,
+                    "summary_message_count": message_count,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                })\
+                .eq("id", conversation_id)\
+                .execute()
+            return True
+        except Exception as e:
+            logger.error("Error saving conversation summary: %s", e)
+            return False
+
+    def update_conversation_summary_async(self, conversation_id: str, summary: str, message_count: int) -> Future:
+        """Store a conversation's rolling summary on the background writer."""
+        return self._writer.submit(self.update_conversation_summary, conversation_id, summary, message_count)
+
     def save_roadmap(self, conversation_id: str, title: str, mermaid_diagram: str, items: List[Dict[str, str]]) -> Optional[str]:
-        """Save a roadmap and its items to the database."""
+        """Save a roadmap and its items to the database in a single round-trip."""
+        try:
+            response = self.client.rpc("save_roadmap_with_items", {
+                "p_conversation_id": conversation_id,
+                "p_title": title,
+                "p_diagram": mermaid_diagram,
+                "p_items": items
+            }).execute()
+
+            return response.data if response.data else None
+        except Exception as e:
+            error_msg = str(e)
+            # Databases created before the function was added to the schema
+            if "PGRST202" in error_msg or "Could not find the function" in error_msg:
+                return self._save_roadmap_with_inserts(conversation_id, title, mermaid_diagram, items)
+            logger.error("Error saving roadmap: %s", e)
+            return None
+
+    def _save_roadmap_with_inserts(self, conversation_id: str, title: str, mermaid_diagram: str, items: List[Dict[str, str]]) -> Optional[str]:
+        """Save a roadmap and its items with two separate inserts."""
         try:
             # Save roadmap
             roadmap_response = self.client.table(self.roadmaps_table).insert({
                 "conversation_id": conversation_id,
                 "title": title,
                 "mermaid_diagram": mermaid_diagram,
-                "created_at": datetime.utcnow().isoformat()
+                "created_at": datetime.now(timezone.utc).isoformat()
             }).execute()
 
             if not roadmap_response.data or len(roadmap_response.data) == 0:
@@ -190,7 +322,7 @@ class SupabaseDB:
 
             return roadmap_id
         except Exception as e:
-            print(f"Error saving roadmap: {e}")
+            logger.error("Error saving roadmap: %s", e)
             return None
 
     def get_roadmaps(self, conversation_id: str) -> List[Dict]:
@@ -204,9 +336,15 @@ class SupabaseDB:
 
             return response.data if response.data else []
         except Exception as e:
-            print(f"Error getting roadmaps: {e}")
+            logger.error("Error getting roadmaps: %s", e)
             return []
 
+    def get_roadmaps_and_progress(self, conversation_id: str, roadmap_id: str) -> Tuple[List[Dict], Dict]:
+        """Fetch a conversation's roadmaps and one roadmap's progress in parallel."""
+        roadmaps_future = self._reader.submit(self.get_roadmaps, conversation_id)
+        progress_future = self._reader.submit(self.get_roadmap_progress, roadmap_id)
+        return roadmaps_future.result(), progress_future.result()
+
     def get_roadmap_items(self, roadmap_id: str) -> List[Dict]:
         """Get all items for a roadmap."""
         try:
@@ -218,7 +356,7 @@ class SupabaseDB:
 
             return response.data if response.data else []
         except Exception as e:
-            print(f"Error getting roadmap items: {e}")
+            logger.error("Error getting roadmap items: %s", e)
             return []
 
     def update_item_progress(self, item_id: str, completed: bool) -> bool:
@@ -226,7 +364,7 @@ class SupabaseDB:
         try:
             update_data = {
                 "completed": completed,
-                "completed_at": datetime.utcnow().isoformat() if completed else None
+                "completed_at": datetime.now(timezone.utc).isoformat() if completed else None
             }
 
             self.client.table(self.roadmap_items_table)\
@@ -235,15 +373,72 @@ class SupabaseDB:
                 .execute()
             return True
         except Exception as e:
-            print(f"Error updating item progress: {e}")
+            logger.error("Error updating item progress: %s", e)
             return False
 
+    def bulk_update_items(self, updates: List[Dict]) -> bool:
+        """Update the completion status of several roadmap items at once.
+
+        Each update is a dict with "id" and "completed" keys. Items are grouped
+        by completion state so at most two requests are sent.
+        """
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            ids_by_state: Dict[bool, List[str]] = {True: [], False: []}
+            for update in updates:
+                ids_by_state[bool(update.get("completed"))].append(update.get("id"))
+
+            for completed, ids in ids_by_state.items():
+                if not ids:
+                    continue
+                self.client.table(self.roadmap_items_table)\
+                    .update({
+                        "completed": completed,
+                        "completed_at": now if completed else None
+                    })\
+                    .in_("id", ids)\
+                    .execute()
+            return True
+        except Exception as e:
+            logger.error("Error bulk updating item progress: %s", e)
+            return False
+
+    def get_roadmap_progress_counts(self, roadmap_id: str) -> Dict:
+        """Get progress statistics for a roadmap without fetching its items.
+
+        Uses two exact-count queries so only the counts travel over the wire.
+        """
+        try:
+            total_response = self.client.table(self.roadmap_items_table)\
+                .select("id", count="exact")\
+                .eq("roadmap_id", roadmap_id)\
+                .limit(0)\
+                .execute()
+            completed_response = self.client.table(self.roadmap_items_table)\
+                .select("id", count="exact")\
+                .eq("roadmap_id", roadmap_id)\
+                .eq("completed", True)\
+                .limit(0)\
+                .execute()
+
+            total_items = total_response.count or 0
+            completed_items = completed_response.count or 0
+
+            return {
+                "total_items": total_items,
+                "completed_items": completed_items,
+                "progress_percentage": (completed_items / total_items * 100) if total_items > 0 else 0
+            }
+        except Exception as e:
+            logger.error("Error getting roadmap progress counts: %s", e)
+            return {"total_items": 0, "completed_items": 0, "progress_percentage": 0}
+
     def get_roadmap_progress(self, roadmap_id: str) -> Dict:
         """Get progress statistics for a roadmap."""
         try:
             items = self.get_roadmap_items(roadmap_id)
             total_items = len(items)
-            completed_items = len([item for item in items if item.get("completed", False)])
+            completed_items = sum(1 for item in items if item.get("completed"))
 
             return {
                 "total_items": total_items,
@@ -252,6 +447,6 @@ class SupabaseDB:
                 "items": items
             }
         except Exception as e:
-            print(f"Error getting roadmap progress: {e}")
+            logger.error("Error getting roadmap progress: %s", e)
             return {"total_items": 0, "completed_items": 0, "progress_percentage": 0, "items": []}
 
@@ -1,49 +1,412 @@
 # backend/gemini_client.py
+import asyncio
+import functools
+import hashlib
+import json
+import logging
 import os
-from typing import List, Dict, Optional
-import google.generativeai as genai
+import queue
+import re
+import sys
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Generator, NamedTuple, Optional, Tuple, Iterator, Iterable
+from urllib.parse import parse_qs, quote_plus, urlparse
 from dotenv import load_dotenv
-from duckduckgo_search import DDGS
+from selectolax.parser import HTMLParser
+try:
+    import orjson
+except ImportError:  # Optional dependency, falls back to the stdlib json module
+    orjson = None
 # Handle import for both direct execution and package import
 try:
     from .database import SupabaseDB
+    from .semantic_cache import SemanticCache
+    from .http_client import get_session, run_sync
 except ImportError:
     from database import SupabaseDB
+    from semantic_cache import SemanticCache
+    from http_client import get_session, run_sync
 
-# Load environment variables from .env file in the backend directory
+# .env file in the backend directory, loaded by init_env() at app startup
 env_path = os.path.join(os.path.dirname(__file__), '.env')
-load_dotenv(env_path)
 
-# function uses a query string and duckduckgo_search library to perform a web search
-def perform_web_search(query: str, max_results: int = 6) -> List[Dict[str, str]]:
-    """Perform a DuckDuckGo search and return a list of results.
+
+def init_env():
+    """Load environment variables from the backend .env file."""
+    load_dotenv(env_path)
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(obj) -> bytes:
+    """Serialize to compact JSON with sorted keys, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+DDG_HTML_URL = "https://html.duckduckgo.com/html/"
+
+
+class SearchResult(NamedTuple):
+    """A single web search result."""
+    title: str
+    href: str
+    body: str
+
+# Mermaid node definitions like A[Label Text] or A[Label]
+_MERMAID_NODE_RE = re.compile(r'([A-Z]\w*)\[([^\]]+)\]')
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_mermaid_cached(mermaid_code: str) -> Tuple[Tuple[str, str], ...]:
+    """Return the (node_id, label) pairs of a diagram, memoized per diagram text."""
+    return tuple(
+        (sys.intern(match.group(1)), match.group(2))
+        for match in _MERMAID_NODE_RE.finditer(mermaid_code)
+    )
+
+# Two-tier cache for search results: in-process LRU, then Redis if REDIS_URL is set
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL = 600
+_search_cache: "OrderedDict[str, Tuple[float, List[SearchResult]]]" = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_redis():
+    """Return a Redis client when REDIS_URL is configured, else None."""
+    redis_url = os.environ.get("REDIS_URL", "")
+    if not redis_url:
+        return None
+    try:
+        import redis
+        return redis.Redis.from_url(redis_url)
+    except Exception as e:
+        logger.warning("Redis search cache disabled: %s", e)
+        return None
+
+
+def _search_cache_key(query: str, max_results: int) -> str:
+    normalized = re.sub(r"\s+", " ", query.strip().lower())
+    return f"ddg:{hashlib.md5(normalized.encode('utf-8')).hexdigest()}:{max_results}"
+
+
+def _get_cached_search(query: str, max_results: int) -> Optional[List[SearchResult]]:
+    """Look up search results in the in-process cache, then Redis."""
+    key = _search_cache_key(query, max_results)
+    with _search_cache_lock:
+        entry = _search_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                _search_cache.move_to_end(key)
+                return entry[1]
+            del _search_cache[key]
+
+    client = _get_redis()
+    if client is None:
+        return None
+    try:
+        cached = client.get(key)
+    except Exception as e:
+        logger.error("Search cache lookup error: %s", e)
+        return None
+    if cached is None:
+        return None
+    results = [SearchResult(*item) for item in _loads(cached)]
+    _store_local_search(key, results)
+    return results
+
+
+def _store_local_search(key: str, results: List[SearchResult]):
+    with _search_cache_lock:
+        _search_cache[key] = (time.time() + SEARCH_CACHE_TTL, results)
+        _search_cache.move_to_end(key)
+        if len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+
+
+def _cache_search(query: str, max_results: int, results: List[SearchResult]):
+    """Store search results in both cache tiers. Empty results aren't cached."""
+    if not results:
+        return
+    key = _search_cache_key(query, max_results)
+    _store_local_search(key, results)
+
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.setex(key, SEARCH_CACHE_TTL, _dumps([list(result) for result in results]))
+        except Exception as e:
+            logger.error("Search cache store error: %s", e)
+
+
+def _resolve_ddg_href(href: str) -> str:
+    """Unwrap DuckDuckGo's /l/?uddg= redirect links to the target URL."""
+    if "uddg=" in href:
+        target = parse_qs(urlparse(href).query).get("uddg")
+        if target:
+            return target[0]
+    if href.startswith("//"):
+        return "https:" + href
+    return href
+
+
+def _parse_ddg_html(html: str, max_results: int) -> List[SearchResult]:
+    """Extract title, href and body from a DuckDuckGo HTML results page."""
+    results: List[SearchResult] = []
+    for node in HTMLParser(html).css("div.result"):
+        # Skip sponsored results
+        if "result--ad" in (node.attributes.get("class") or ""):
+            continue
+        link = node.css_first(".result__title a")
+        if link is None:
+            continue
+        snippet = node.css_first(".result__snippet")
+        results.append(SearchResult(
+            link.text(strip=True),
+            _resolve_ddg_href(link.attributes.get("href") or ""),
+            snippet.text(strip=True) if snippet is not None else ""
+        ))
+        if len(results) >= max_results:
+            break
+    return results
+
+
+async def perform_web_search_async(query: str, max_results: int = 6) -> List[SearchResult]:
+    """Search the DuckDuckGo HTML endpoint over the pooled aiohttp session.
 
     Each result contains: title, href, body.
     """
-    results: List[Dict[str, str]] = []
+    session = await get_session()
+    async with session.get(f"{DDG_HTML_URL}?q={quote_plus(query)}") as response:
+        response.raise_for_status()
+        html = await response.text()
+    return _parse_ddg_html(html, max_results)
+
+
+async def perform_web_search_multi(queries: List[str], per_host_limit: int = 4,
+                                   max_results: int = 6) -> List[SearchResult]:
+    """Run several searches concurrently and merge the results.
+
+    At most per_host_limit requests are in flight at once. Results are
+    deduplicated by href, keeping the order of the queries.
+    """
+    semaphore = asyncio.Semaphore(per_host_limit)
+
+    async def search(query: str) -> List[SearchResult]:
+        cached = _get_cached_search(query, max_results)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            results = await perform_web_search_async(query, max_results)
+        _cache_search(query, max_results, results)
+        return results
+
+    batches = await asyncio.gather(*(search(query) for query in queries), return_exceptions=True)
+
+    results: List[SearchResult] = []
+    seen = set()
+    for query, batch in zip(queries, batches):
+        if isinstance(batch, Exception):
+            logger.error("Search error for '%s': %s", query, batch)
+            continue
+        for result in batch:
+            if result.href in seen:
+                continue
+            seen.add(result.href)
+            results.append(result)
+    return results
+
+
+# function uses a query string to perform a web search
+def perform_web_search(query: str, max_results: int = 6) -> List[SearchResult]:
+    """Perform a DuckDuckGo search and return a list of results.
+
+    Each result contains: title, href, body. Falls back to the
+    duckduckgo_search library if the HTML endpoint fails or returns nothing.
+    Results are cached for SEARCH_CACHE_TTL seconds by normalized query.
+    """
+    cached = _get_cached_search(query, max_results)
+    if cached is not None:
+        return cached
+
+    results = _search_uncached(query, max_results)
+    _cache_search(query, max_results, results)
+    return results
+
+
+def _search_uncached(query: str, max_results: int) -> List[SearchResult]:
+    results: List[SearchResult] = []
+    try:
+        results = run_sync(perform_web_search_async(query, max_results))
+    except Exception as e:
+        logger.warning("Search error: %s", e, exc_info=True)
+    if results:
+        return results
+
+    ddgs = _acquire_ddgs()
     try:
-        with DDGS() as ddgs:
-            for result in ddgs.text(query, max_results=max_results):
-                # result keys typically include: title, href, body
-                results.append({
-                    "title": result.get("title", ""),
-                    "href": result.get("href", ""),
-                    "body": result.get("body", "")
-                })
+        for result in ddgs.text(query, max_results=max_results):
+            # result keys typically include: title, href, body
+            results.append(SearchResult(
+                result.get("title", ""),
+                result.get("href", ""),
+                result.get("body", "")
+            ))
     except Exception as e:
-        print(f"Search error: {e}")
+        # Don't hand a client in an unknown state to the next search
+        logger.warning("Search error: %s", e, exc_info=True)
+        return results
+    _release_ddgs(ddgs)
     return results
 
 
+# Idle DDGS clients, reused so later searches keep their HTTP connections
+_DDGS_POOL: "queue.Queue" = queue.Queue(maxsize=4)
+
+
+def _acquire_ddgs():
+    """Take an idle DDGS client from the pool, creating one if none is free."""
+    try:
+        return _DDGS_POOL.get_nowait()
+    except queue.Empty:
+        # Imported here; it's only needed when the HTML endpoint fails
+        from duckduckgo_search import DDGS
+        return DDGS()
+
+
+def _release_ddgs(ddgs):
+    """Return a DDGS client to the pool, dropping it if the pool is full."""
+    try:
+        _DDGS_POOL.put_nowait(ddgs)
+    except queue.Full:
+        pass
+
+
+# Rolling summaries are slow Gemini calls, so they get their own threads rather
+# than holding up message inserts and the exit flush of the database writer
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini-summarizer")
+
+
+# Longest a follower waits for the next chunk of a shared response
+FLIGHT_WAIT_TIMEOUT = 30
+
+
+class _FlightAbandoned(Exception):
+    """The client making a shared request stopped reading before it finished."""
+
+
+class _Flight:
+    """A Gemini response being streamed, which identical requests can follow."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._cond = threading.Condition()
+
+    def push(self, text: str):
+        with self._cond:
+            self.chunks.append(text)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[Exception] = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self, timeout: float = FLIGHT_WAIT_TIMEOUT) -> Iterator[str]:
+        """Yield chunks as the leader pushes them; raise if the leader failed.
+
+        Raises TimeoutError if the leader sends nothing for timeout seconds,
+        e.g. because its caller stopped reading without closing the stream,
+        and _FlightAbandoned if the caller closed it.
+        """
+        seen = 0
+        while True:
+            with self._cond:
+                while seen == len(self.chunks) and not self.done:
+                    if not self._cond.wait(timeout):
+                        raise TimeoutError("the original request stalled")
+                new_chunks = self.chunks[seen:]
+                seen = len(self.chunks)
+                done, error = self.done, self.error
+            yield from new_chunks
+            if done:
+                if isinstance(error, _FlightAbandoned):
+                    raise error
+                if error is not None:
+                    raise RuntimeError(str(error))
+                return
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _join_flight(key: str) -> Tuple[_Flight, bool]:
+    """Return the in-flight request for key and whether the caller must make it."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _land_flight(key: str, flight: _Flight, error: Optional[Exception] = None):
+    """Mark a request as finished and release its followers."""
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+    flight.finish(error)
+
+
+def _skip_shown(chunks: Iterable[str], shown: Optional[str]) -> Iterator[str]:
+    """Yield a regenerated response without the start the caller already shows.
+
+    If the new response turns out different, it follows the shown text in full.
+    """
+    pending = ""
+    for text in chunks:
+        if shown is None:
+            yield text
+            continue
+        pending += text
+        if shown.startswith(pending):
+            continue
+        yield pending[len(shown):] if pending.startswith(shown) else "\n\n" + pending
+        shown = None
+
+
+@functools.lru_cache(maxsize=None)
+def _configure_genai(api_key: str):
+    """Import and configure google.generativeai once per API key."""
+    # Imported lazily: it pulls in gRPC and protobuf, which modules that only
+    # use the search or database helpers don't need
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai
+
+
 class GeminiClient:
-    def __init__(self, use_database: bool = True):
+    def __init__(self, use_database: bool = True, use_semantic_cache: Optional[bool] = None):
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+        genai = _configure_genai(api_key)
         self.conversation_history: List[Dict[str, str]] = []
+        # Messages of the current turn, saved together once the turn ends
+        self._pending_messages: List[Tuple[str, str]] = []
         self.use_database = use_database
         self.db: Optional[SupabaseDB] = None
         self.current_conversation_id: Optional[str] = None
@@ -52,10 +415,10 @@ class GeminiClient:
             try:
                 self.db = SupabaseDB()
             except Exception as e:
-                print(f"Warning: Could not initialize Supabase. Running without persistence: {e}")
+                logger.warning("Could not initialize Supabase. Running without persistence: %s", e)
                 self.use_database = False
                 self.db = None
-        self.system_prompt = """
+        self.system_prompt = textwrap.dedent("""
             You are an AI Study Planner Agent. Your role is to help users create effective study plans,
             learning roadmaps, and structured educational guidance.
 
@@ -147,20 +510,145 @@ class GeminiClient:
             Be encouraging, concise, and educational
 
             Adapt the roadmap depth to the user’s level (beginner, intermediate, advanced)
-            """
+            """).strip()
+
+        # The system prompt is sent once as a system instruction, not with every turn
+        self.model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=self.system_prompt)
+        # User settings primed at the start of the chat session
+        self._settings_context = ""
+        self._last_settings_hash: Optional[str] = None
+        self._rebuild_chat_session([])
+
+        # Only the last window_size messages are replayed verbatim; older ones are
+        # folded into a rolling summary every summary_every messages
+        self.window_size = 12
+        self.summary_every = 10
+        self.rolling_summary = ""
+        self.summary_message_count = 0
+        # Summary being generated in the background, and how many messages it folds
+        self._summary_job: Optional[Tuple[Future, int]] = None
+        # Plain model for summaries, without the study planner instructions
+        self.summary_model = genai.GenerativeModel("gemini-2.5-flash")
+
+        # Off unless asked for: it loads sentence-transformers and embeds every turn
+        if use_semantic_cache is None:
+            use_semantic_cache = os.getenv("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes")
+        self.scache: Optional[SemanticCache] = None
+        if use_semantic_cache:
+            try:
+                self.scache = SemanticCache(self.system_prompt)
+            except Exception as e:
+                logger.warning("Semantic cache disabled: %s", e)
+
+    def _detect_search_query(self, user_message: str) -> List[str] | None:
+        """Detect if the user wants to perform a web search.
+
+        Returns the list of queries to run; "search-all: q1 | q2" yields several.
+        """
+        # Only the prefix matters, so don't lowercase the whole message
+        message = user_message.lstrip()
+        head = message[:11].lower()
+
+        if head.startswith("search-all:"):
+            queries = [query.strip() for query in message[len("search-all:"):].split("|")]
+            queries = [query for query in queries if query]
+            return queries if queries else None
+
+        # "search:" and "/search" are the same length
+        if head.startswith(("search:", "/search")):
+            query = message[len("search:"):].strip()
+            return [query] if query else None
+        return None
 
-    def _detect_search_query(self, user_message: str) -> str | None:
-        """Detect if the user wants to perform a web search."""
-        user_message_lower = user_message.lower().strip()
-        
-        if user_message_lower.startswith("search:") or user_message_lower.startswith("/search"):
-            # Extract the query after "search:" or "/search"
-            if user_message_lower.startswith("search:"):
-                query = user_message[len("search:"):].strip()
+    def _rebuild_chat_session(self, history: List[Dict[str, str]]):
+        """Start a new Gemini chat session primed with the settings and the given history."""
+        contents = []
+        if self._settings_context:
+            # Sent once at the start of the session rather than with every message
+            contents.append({"role": "user", "parts": [f"[System] {self._settings_context.strip()}"]})
+            contents.append({"role": "model", "parts": ["Noted."]})
+        for msg in history:
+            if msg["role"] == "system":
+                # Gemini chat history only has user and model turns
+                contents.append({"role": "user", "parts": [f"Summary of our conversation so far:\n{msg['content']}"]})
+                contents.append({"role": "model", "parts": ["Understood, I'll keep that in mind."]})
             else:
-                query = user_message[len("/search"):].strip()
-            return query if query else None
-        return None
+                contents.append({"role": "user" if msg["role"] == "user" else "model", "parts": [msg["content"]]})
+        self.chat_session = self.model.start_chat(history=contents)
+
+    def _load_history(self, conversation_id: str):
+        """Load a conversation's history, starting from its rolling summary if it has one."""
+        history = self.db.get_conversation_history(conversation_id)
+        summary, summary_count = self.db.get_conversation_summary(conversation_id)
+
+        if summary and summary_count <= len(history):
+            self.rolling_summary = summary
+            self.summary_message_count = summary_count
+            history = [{"role": "system", "content": summary}] + history[summary_count:]
+        else:
+            self.rolling_summary = ""
+            self.summary_message_count = 0
+
+        # A summary started for the previous history no longer applies
+        self._summary_job = None
+        self.conversation_history = history
+        self._rebuild_chat_session(self.conversation_history)
+
+    def _summarize_old_turns(self):
+        """Start folding the messages older than the window into the rolling summary.
+
+        The summary call runs on the summarizer threads so the end of a stream
+        never waits on it; _apply_summary folds the result in on a later turn.
+        """
+        if self._summary_job is not None:
+            return
+        history = self.conversation_history
+        if history and history[0]["role"] == "system":
+            history = history[1:]
+        if len(history) <= self.window_size + self.summary_every:
+            return
+
+        old_turns = history[:-self.window_size]
+        old_text = "\n\n".join(
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+            for msg in old_turns
+        )
+        if self.rolling_summary:
+            old_text = f"Earlier summary:\n{self.rolling_summary}\n\n{old_text}"
+
+        self._summary_job = (_summarizer.submit(self._generate_summary, old_text), len(old_turns))
+
+    def _generate_summary(self, old_text: str) -> str:
+        response = self.summary_model.generate_content(
+            "Summarize briefly this study planning conversation, keeping the user's goals, "
+            "level, preferences and the plans already given:\n\n" + old_text
+        )
+        return response.text.strip()
+
+    def _apply_summary(self):
+        """Replace the summarised messages with a finished background summary, if any."""
+        job = self._summary_job
+        if job is None or not job[0].done():
+            return
+        self._summary_job = None
+        future, folded = job
+        try:
+            summary = future.result()
+        except Exception as e:
+            # Keep the full history and try again after the next turn
+            logger.error("Error summarizing conversation: %s", e)
+            return
+
+        history = self.conversation_history
+        if history and history[0]["role"] == "system":
+            history = history[1:]
+        self.rolling_summary = summary
+        self.summary_message_count += folded
+        self.conversation_history = [{"role": "system", "content": summary}] + history[folded:]
+        self._rebuild_chat_session(self.conversation_history)
+
+        if self.use_database and self.db and self.current_conversation_id:
+            self.db.update_conversation_summary_async(self.current_conversation_id, summary, self.summary_message_count)
 
     def set_conversation_id(self, conversation_id: str):
         """Set the current conversation ID and load history from database."""
@@ -168,10 +656,33 @@ class GeminiClient:
         
         if self.use_database and self.db:
             # Load conversation history from database
-            self.conversation_history = self.db.get_conversation_history(conversation_id)
+            self._load_history(conversation_id)
+
+    def record_turn(self, user_message: str, ai_response: str):
+        """Add a turn answered without calling Gemini, e.g. from a frontend cache."""
+        self._apply_summary()
+        self.conversation_history.append({"role": "user", "content": user_message})
+        self._flush_pending_messages()
+        self._pending_messages.append(("user", user_message))
+        self._record_response(ai_response)
+        # Keep the Gemini session in step with the recorded history
+        self._rebuild_chat_session(self.conversation_history)
+
+    def restore_history(self, messages: List[Dict[str, str]]):
+        """Continue a conversation saved outside the database, e.g. after a page reload."""
+        self._summary_job = None
+        self.conversation_history = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+        self._rebuild_chat_session(self.conversation_history)
+
+    def _prepare_turn(self, user_message: str, session_id: Optional[str] = None, user_settings: Optional[Dict] = None) -> Tuple[str, str, Optional[List[str]]]:
+        """Record the user turn.
+
+        Returns the message to send to Gemini, the settings context included in
+        it, and the web search query (if any).
+        """
+        # Fold in a summary finished since the last turn, before this turn is sent
+        self._apply_summary()
 
-    def chat(self, user_message: str, session_id: Optional[str] = None, user_settings: Optional[Dict] = None) -> str:
-        """Process user message and return AI response."""
         # Initialize conversation if using database
         if self.use_database and self.db and session_id:
             if not self.current_conversation_id:
@@ -180,22 +691,28 @@ class GeminiClient:
                     self.set_conversation_id(conversation_id)
             elif not self.conversation_history:
                 # Reload history if empty
-                self.conversation_history = self.db.get_conversation_history(self.current_conversation_id)
+                self._load_history(self.current_conversation_id)
         
         # Check if user wants to search
         search_query = self._detect_search_query(user_message)
         
         if search_query:
-            # Perform web search
-            search_results = perform_web_search(search_query, max_results=6)
+            # Perform web search, fanning out when there are several queries
+            if len(search_query) == 1:
+                search_results = perform_web_search(search_query[0], max_results=6)
+            else:
+                try:
+                    search_results = run_sync(perform_web_search_multi(search_query, per_host_limit=4))
+                except Exception as e:
+                    logger.warning("Search error: %s", e, exc_info=True)
+                    search_results = []
             
             if search_results:
                 # Format search results for the model
-                search_context = "\n\n--- Web Search Results ---\n"
-                for idx, result in enumerate(search_results, 1):
-                    search_context += f"\n[{idx}] {result['title']}\n"
-                    search_context += f"URL: {result['href']}\n"
-                    search_context += f"Summary: {result['body']}\n"
+                search_context = "\n\n--- Web Search Results ---\n" + "".join(
+                    f"\n[{idx}] {title}\nURL: {href}\nSummary: {body}\n"
+                    for idx, (title, href, body) in enumerate(search_results, 1)
+                )
                 
                 # Add search context to the user message
                 enhanced_message = f"{user_message}\n\n{search_context}\n\nPlease provide a helpful response based on these search results, citing sources with [1], [2], etc."
@@ -216,61 +733,195 @@ class GeminiClient:
                 settings_parts.append(f"Study Field: {user_settings['study_field']}")
             if settings_parts:
                 settings_context = "\n\nUser Settings:\n" + "\n".join(settings_parts) + "\n"
-                enhanced_message = settings_context + enhanced_message
+
+        # Settings go into the session primer, so only re-prime when they change
+        settings_hash = hashlib.blake2b(_dumps(user_settings or {}), digest_size=8).hexdigest()
+        if settings_hash != self._last_settings_hash:
+            self._last_settings_hash = settings_hash
+            self._settings_context = settings_context
+            self._rebuild_chat_session(self.conversation_history)
 
         # Add user message to conversation history
         self.conversation_history.append({"role": "user", "content": enhanced_message})
         
-        # Save user message to database
-        if self.use_database and self.db and self.current_conversation_id:
-            self.db.save_message(self.current_conversation_id, "user", enhanced_message)
-
-        # Prepare the full conversation context
-        conversation_text = self.system_prompt + "\n\n"
-        for msg in self.conversation_history:
-            role = msg["role"]
-            content = msg["content"]
-            if role == "user":
-                conversation_text += f"User: {content}\n\n"
-            else:
-                conversation_text += f"Assistant: {content}\n\n"
+        # Queue the user message; it is saved together with the response.
+        # Anything still pending belongs to an abandoned turn, so save it first.
+        self._flush_pending_messages()
+        self._pending_messages.append(("user", enhanced_message))
+
+        return enhanced_message, settings_context, search_query
+
+    def _record_response(self, ai_response: str):
+        """Add the AI response to the conversation history and database."""
+        # Add AI response to conversation history
+        self.conversation_history.append({"role": "assistant", "content": ai_response})
         
-        conversation_text += "Assistant:"
+        # Save the user message and AI response to the database in one insert
+        self._pending_messages.append(("assistant", ai_response))
+        self._flush_pending_messages()
+
+        self._summarize_old_turns()
+
+    def _flush_pending_messages(self):
+        """Save the queued messages of this turn to the database."""
+        pending, self._pending_messages = self._pending_messages, []
+        if pending and self.use_database and self.db and self.current_conversation_id:
+            self.db.save_messages_bulk_async(self.current_conversation_id, pending)
+
+    def _cache_scope(self, settings_context: str) -> str:
+        """Key the semantic cache on the settings and the conversation before this turn.
+
+        Follow-ups like "make it shorter" only mean the same thing after the
+        same history, so another conversation's answer must never match.
+        """
+        return hashlib.blake2b(
+            _dumps([settings_context, self.conversation_history[:-1]]),
+            digest_size=16
+        ).hexdigest()
+
+    def _lookup_cached_response(self, user_message: str, cache_scope: str, search_query: Optional[List[str]]) -> Optional[str]:
+        """Return a semantically cached response for this turn and record it, if any."""
+        # Search turns want fresh web data, so they never use the cache
+        if not self.scache or search_query:
+            return None
 
-        try:
-            # Generate response using Gemini
-            response = self.model.generate_content(conversation_text)
-            ai_response = response.text.strip()
+        cached_response = self.scache.lookup(user_message, cache_scope)
+        if cached_response is not None:
+            self._record_response(cached_response)
+            # Keep the Gemini session in step with the recorded history
+            self._rebuild_chat_session(self.conversation_history)
+        return cached_response
 
-            # Add AI response to conversation history
-            self.conversation_history.append({"role": "assistant", "content": ai_response})
-            
-            # Save AI response to database
-            if self.use_database and self.db and self.current_conversation_id:
-                self.db.save_message(self.current_conversation_id, "assistant", ai_response)
+    def _store_cached_response(self, user_message: str, cache_scope: str, search_query: Optional[List[str]], ai_response: str):
+        """Add a freshly generated response to the semantic cache."""
+        if self.scache and not search_query:
+            self.scache.store(user_message, ai_response, cache_scope, ttl=900)
+
+    def chat(self, user_message: str, session_id: Optional[str] = None, user_settings: Optional[Dict] = None) -> str:
+        """Process user message and return AI response."""
+        # Thin wrapper over the stream for callers that need the whole response
+        return "".join(self.chat_stream(user_message, session_id, user_settings)).strip()
+
+    def chat_stream(self, user_message: str, session_id: Optional[str] = None, user_settings: Optional[Dict] = None) -> Iterator[str]:
+        """Process user message and yield the AI response as it is generated.
+
+        The full response is added to the history once the stream finishes.
+        """
+        enhanced_message, settings_context, search_query = self._prepare_turn(user_message, session_id, user_settings)
+
+        cache_scope = self._cache_scope(settings_context)
+        cached_response = self._lookup_cached_response(user_message, cache_scope, search_query)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        # Identical requests in flight share a single Gemini call
+        flight_key = self._flight_key()
+        flight, is_leader = _join_flight(flight_key)
+        shown = ""
+        if not is_leader:
+            shown = yield from self._follow_flight(flight)
+            if shown is None:
+                return
+            # The leader stalled or was abandoned; make the call directly
+            flight = None
+
+        chunks: List[str] = []
+        landed = flight is None
+        finished = failed = False
+        def generate() -> Iterator[str]:
+            # Generate response using Gemini, streaming chunks as they arrive
+            for chunk in self.chat_session.send_message(enhanced_message, stream=True):
+                text = chunk.text
+                if text:
+                    chunks.append(text)
+                    if flight is not None:
+                        flight.push(text)
+                    yield text
 
-            return ai_response
+        try:
+            yield from _skip_shown(generate(), shown) if shown else generate()
+            finished = True
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            failed = True
+            # A broken stream leaves the session mid-turn; restart it without the failed turn
+            self._rebuild_chat_session(self.conversation_history[:-1])
+            self._flush_pending_messages()
+            # Release the followers before handing the error to this caller
+            if not landed:
+                _land_flight(flight_key, flight, e)
+                landed = True
+            yield f"Error generating response: {str(e)}"
+            return
+        finally:
+            if not finished and not failed:
+                # The caller stopped reading (a rerun, Stop or a client disconnect), which
+                # leaves the session mid-turn too; restart it without the unfinished turn
+                self._rebuild_chat_session(self.conversation_history[:-1])
+                self._flush_pending_messages()
+            if not landed:
+                # Not finished means the caller stopped reading before the response ended
+                _land_flight(flight_key, flight, None if finished else _FlightAbandoned("the original request was abandoned"))
+
+        ai_response = "".join(chunks).strip()
+        self._record_response(ai_response)
+        self._store_cached_response(user_message, cache_scope, search_query, ai_response)
+
+    def _flight_key(self) -> str:
+        """Key identifying the full request about to be sent to Gemini."""
+        return hashlib.blake2b(
+            _dumps([self.system_prompt, self._settings_context, self.conversation_history]),
+            digest_size=16
+        ).hexdigest()
+
+    def _follow_flight(self, flight: "_Flight") -> Generator[str, None, Optional[str]]:
+        """Yield another client's in-flight response and record it as this turn's.
+
+        Returns None once the response is complete. If the leader stalled or
+        was abandoned, returns the text yielded so far instead, so the caller
+        can make the request itself and continue after it.
+        """
+        chunks: List[str] = []
+        try:
+            for text in flight.follow():
+                chunks.append(text)
+                yield text
+        except (TimeoutError, _FlightAbandoned):
+            return "".join(chunks)
+        except Exception as e:
+            self._flush_pending_messages()
+            yield f"Error generating response: {str(e)}"
+            return None
+
+        self._record_response("".join(chunks).strip())
+        # Keep the Gemini session in step with the recorded history
+        self._rebuild_chat_session(self.conversation_history)
+        return None
 
     def reset_conversation(self):
         """Reset the conversation history."""
         if self.use_database and self.db and self.current_conversation_id:
             self.db.clear_conversation(self.current_conversation_id)
+            if self.rolling_summary:
+                self.db.update_conversation_summary_async(self.current_conversation_id, "", 0)
         self.conversation_history = []
+        self._pending_messages = []
+        self.rolling_summary = ""
+        self.summary_message_count = 0
+        self._summary_job = None
         self.current_conversation_id = None
+        self._rebuild_chat_session([])
 
     def parse_mermaid_diagram(self, mermaid_code: str) -> List[Dict[str, str]]:
         """Parse Mermaid diagram code to extract nodes and their labels."""
-        import re
+        return self._nodes_to_items(_parse_mermaid_cached(mermaid_code))
 
+    @staticmethod
+    def _nodes_to_items(nodes: Iterable[Tuple[str, str]]) -> List[Dict[str, str]]:
+        """Turn (node_id, label) pairs into roadmap items."""
         items = []
 
-        # Find all node definitions like A[Label Text] or A[Label]
-        node_pattern = r'([A-Z]\w*)\[([^\]]+)\]'
-        matches = re.findall(node_pattern, mermaid_code)
-
-        for node_id, label in matches:
+        for node_id, label in nodes:
             # Clean up the label
             clean_label = label.strip()
             items.append({
@@ -281,14 +932,21 @@ class GeminiClient:
 
         return items
 
-    def save_roadmap(self, title: str, mermaid_diagram: str) -> Optional[str]:
-        """Save a roadmap with its items to the database."""
+    def save_roadmap(self, title: str, mermaid_diagram: str, nodes: Optional[List[Tuple[str, str]]] = None) -> Optional[str]:
+        """Save a roadmap with its items to the database.
+
+        Pass ``nodes`` as (node_id, label) pairs when the caller has already
+        scanned the diagram, to skip parsing it again.
+        """
         if not self.use_database or not self.db or not self.current_conversation_id:
             return None
 
         try:
             # Parse the diagram to extract items
-            items = self.parse_mermaid_diagram(mermaid_diagram)
+            if nodes is None:
+                items = self.parse_mermaid_diagram(mermaid_diagram)
+            else:
+                items = self._nodes_to_items(nodes)
 
             # Save roadmap and items
             roadmap_id = self.db.save_roadmap(
@@ -300,7 +958,7 @@ class GeminiClient:
 
             return roadmap_id
         except Exception as e:
-            print(f"Error saving roadmap: {e}")
+            logger.error("Error saving roadmap: %s", e)
             return None
 
     def get_roadmaps(self) -> List[Dict]:
@@ -310,6 +968,16 @@ class GeminiClient:
 
         return self.db.get_roadmaps(self.current_conversation_id)
 
+    def get_roadmaps_and_progress(self, roadmap_id: str) -> Tuple[List[Dict], Dict]:
+        """Get the current conversation's roadmaps and one roadmap's progress together."""
+        empty_progress = {"total_items": 0, "completed_items": 0, "progress_percentage": 0, "items": []}
+        if not self.use_database or not self.db:
+            return [], empty_progress
+        if not self.current_conversation_id:
+            return [], self.db.get_roadmap_progress(roadmap_id)
+
+        return self.db.get_roadmaps_and_progress(self.current_conversation_id, roadmap_id)
+
     def get_roadmap_progress(self, roadmap_id: str) -> Dict:
         """Get progress for a specific roadmap."""
         if not self.use_database or not self.db:
@@ -317,6 +985,13 @@ class GeminiClient:
 
         return self.db.get_roadmap_progress(roadmap_id)
 
+    def get_roadmap_progress_counts(self, roadmap_id: str) -> Dict:
+        """Get progress counts for a roadmap without loading its items."""
+        if not self.use_database or not self.db:
+            return {"total_items": 0, "completed_items": 0, "progress_percentage": 0}
+
+        return self.db.get_roadmap_progress_counts(roadmap_id)
+
     def update_item_progress(self, item_id: str, completed: bool) -> bool:
         """Update the completion status of a roadmap item."""
         if not self.use_database or not self.db:
@@ -324,3 +999,9 @@ class GeminiClient:
 
         return self.db.update_item_progress(item_id, completed)
 
+    def bulk_update_items(self, updates: List[Dict]) -> bool:
+        """Update the completion status of several roadmap items in one batch."""
+        if not self.use_database or not self.db:
+            return False
+
+        return self.db.bulk_update_items(updates)
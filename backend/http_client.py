@@ -0,0 +1,51 @@
+# backend/http_client.py
+import asyncio
+import threading
+from typing import Any, Awaitable, Dict, Optional
+
+import aiohttp
+
+# One pooled ClientSession per event loop, so TCP/TLS connections are reused
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+# Background loop used by synchronous callers (Streamlit, Flask)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/124.0 Safari/537.36"
+}
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the shared ClientSession for the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=15),
+            headers=_HEADERS
+        )
+        _sessions[loop] = session
+    return session
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Start the background event loop on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="http-client-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro: Awaitable[Any], timeout: float = 30) -> Any:
+    """Run a coroutine on the background loop and wait for its result.
+
+    Keeps the pooled session alive between calls, unlike asyncio.run, which
+    would create and tear down a new loop (and connection pool) every time.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout=timeout)
@@ -0,0 +1,30 @@
+# backend/log_config.py
+import atexit
+import functools
+import logging
+import logging.handlers
+import queue
+
+
+@functools.lru_cache(maxsize=1)
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Send log records through a queue to a background writer thread.
+
+    Request threads only enqueue records, so a slow stdout or log pipe never
+    blocks them. Safe to call more than once; only the first call configures
+    logging.
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    # Flush queued records before the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,143 @@
+# backend/semantic_cache.py
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency, checked when SemanticCache is created
+    np = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+
+@functools.lru_cache(maxsize=1)
+def _get_embedder():
+    """Load the sentence-transformers model once per process."""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Cache Gemini responses for repeated or near-duplicate prompts.
+
+    Entries are scoped by system prompt and a caller-supplied scope (the user
+    settings and conversation so far), and matched on the cosine similarity of
+    the user message embedding. Uses a RediSearch HNSW
+    index when REDIS_URL is set, otherwise an in-process index.
+    """
+
+    def __init__(self, system_prompt: str, threshold: float = 0.95, default_ttl: int = 900,
+                 max_entries: int = 1000):
+        # Fail fast if the optional dependencies aren't installed
+        if np is None:
+            raise ImportError("numpy is required for the semantic cache")
+        import sentence_transformers  # noqa: F401
+
+        self.namespace = f"scache:{_md5(system_prompt)}"
+        self.threshold = threshold
+        self.default_ttl = default_ttl
+        self._redis = None
+        self.max_entries = max_entries
+        # In-process index; the oldest entries are evicted past max_entries
+        self._entries: Deque[Tuple[float, str, "np.ndarray", str]] = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+        redis_url = os.environ.get("REDIS_URL", "")
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+            self._ensure_index()
+
+    def _ensure_index(self):
+        """Create the RediSearch vector index for this namespace if needed."""
+        from redis.commands.search.field import TagField, VectorField
+        from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+        index = self._redis.ft(self.namespace)
+        try:
+            index.info()
+        except Exception:
+            index.create_index(
+                [
+                    TagField("settings"),
+                    VectorField("embedding", "HNSW", {
+                        "TYPE": "FLOAT32",
+                        "DIM": EMBEDDING_DIM,
+                        "DISTANCE_METRIC": "COSINE"
+                    })
+                ],
+                definition=IndexDefinition(prefix=[f"{self.namespace}:"], index_type=IndexType.HASH)
+            )
+
+    def _embed(self, text: str) -> "np.ndarray":
+        return _get_embedder().encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def lookup(self, user_message: str, scope: str = "") -> Optional[str]:
+        """Return a cached response for a similar message, or None."""
+        try:
+            vector = self._embed(user_message)
+            scope_key = _md5(scope)
+
+            if self._redis is not None:
+                from redis.commands.search.query import Query
+
+                query = Query(f"(@settings:{{{scope_key}}})=>[KNN 1 @embedding $vec AS distance]")\
+                    .return_fields("response", "distance")\
+                    .dialect(2)
+                result = self._redis.ft(self.namespace).search(query, {"vec": vector.tobytes()})
+                if result.docs and 1 - float(result.docs[0].distance) >= self.threshold:
+                    response = result.docs[0].response
+                    # The client isn't created with decode_responses, so fields may be bytes
+                    return response.decode("utf-8") if isinstance(response, bytes) else response
+                return None
+
+            now = time.time()
+            with self._lock:
+                self._entries = deque((entry for entry in self._entries if entry[0] > now), maxlen=self.max_entries)
+                best_score, best_response = 0.0, None
+                for _, entry_scope, entry_vector, response in self._entries:
+                    if entry_scope != scope_key:
+                        continue
+                    score = float(np.dot(vector, entry_vector))
+                    if score > best_score:
+                        best_score, best_response = score, response
+            return best_response if best_score >= self.threshold else None
+        except Exception as e:
+            logger.error("Semantic cache lookup error: %s", e)
+            return None
+
+    def store(self, user_message: str, response: str, scope: str = "", ttl: Optional[int] = None):
+        """Cache a response for a user message."""
+        ttl = ttl or self.default_ttl
+        try:
+            vector = self._embed(user_message)
+            scope_key = _md5(scope)
+
+            if self._redis is not None:
+                key = f"{self.namespace}:{uuid.uuid4().hex}"
+                self._redis.hset(key, mapping={
+                    "settings": scope_key,
+                    "response": response,
+                    "embedding": vector.tobytes()
+                })
+                self._redis.expire(key, ttl)
+                return
+
+            with self._lock:
+                self._entries.append((time.time() + ttl, scope_key, vector, response))
+        except Exception as e:
+            logger.error("Semantic cache store error: %s", e)
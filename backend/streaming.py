@@ -0,0 +1,48 @@
+# backend/streaming.py
+from typing import Iterable, Iterator, List, Pattern
+
+# Shown in place of a Mermaid block while the response streams
+DIAGRAM_NOTICE = "\n\n*📊 Drawing roadmap diagram...*\n\n"
+
+
+def stream_without_mermaid(chunks: Iterable[str], collected: List[str], opener: Pattern[str]) -> Iterator[str]:
+    """Yield streamed text, holding back fenced Mermaid blocks until the stream ends.
+
+    ``opener`` matches the opening fence of a Mermaid block. Every chunk is
+    appended to ``collected`` so the caller can rebuild the full response;
+    the diagram itself is rendered once, after streaming completes.
+    """
+    tail = ""
+    in_mermaid = False
+    for chunk in chunks:
+        collected.append(chunk)
+        tail += chunk
+        while tail:
+            if in_mermaid:
+                end = tail.find("```")
+                if end < 0:
+                    # Keep a possible partial closing fence
+                    tail = tail[-2:]
+                    break
+                tail = tail[end + 3:]
+                in_mermaid = False
+                continue
+
+            match = opener.search(tail)
+            if match:
+                yield tail[:match.start()] + DIAGRAM_NOTICE
+                tail = tail[match.end():]
+                in_mermaid = True
+                continue
+
+            # Hold back a trailing fence that may still turn out to be Mermaid
+            fence = tail.find("`", max(0, len(tail) - 16))
+            if fence >= 0:
+                yield tail[:fence]
+                tail = tail[fence:]
+            else:
+                yield tail
+                tail = ""
+            break
+    if tail and not in_mermaid:
+        yield tail
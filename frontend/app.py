@@ -2,14 +2,27 @@
 import streamlit as st
 from streamlit_mermaid import st_mermaid
 import uuid
-import os
 import re
-from dotenv import load_dotenv
-from backend.gemini_client import GeminiClient
+from backend.gemini_client import GeminiClient, init_env
+from backend.log_config import setup_logging
+from backend.streaming import stream_without_mermaid
 
-# Load environment variables
-env_path = os.path.join(os.path.dirname(__file__), 'backend', '.env')
-load_dotenv(env_path)
+
+@st.cache_resource(show_spinner=False)
+def _load_env():
+    """Load the .env file and set up logging once per process instead of on every script rerun."""
+    init_env()
+    setup_logging()
+
+
+# Opening Mermaid fence, compiled once instead of on every chat turn
+_MERMAID_RE_OPEN = re.compile(r'```\s*mermaid')
+
+# Sidebar choices, built once instead of on every rerun
+_LEVELS = ("Beginner", "Intermediate", "Advanced")
+_DURATIONS = ("1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom")
+# Preset durations only; anything else maps to "Custom"
+_DURATION_INDEX = {d: i for i, d in enumerate(_DURATIONS[:-1])}
 
 # Page configuration
 st.set_page_config(
@@ -19,6 +32,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+_load_env()
+
 # Initialize session state
 if "gemini_client" not in st.session_state:
     try:
@@ -45,8 +60,106 @@ if not st.session_state.get("db_initialized", False) and not st.session_state.ge
     )
     st.session_state.db_warning_shown = True
 
+
+# Cached database reads (Streamlit reruns the whole script on every interaction)
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_roadmaps(session_id):
+    """Return the roadmaps for the current session, cached per session ID."""
+    return st.session_state.gemini_client.get_roadmaps()
+
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _cached_tracker(session_id, roadmap_id):
+    """Return (roadmaps, progress) fetched in parallel, cached per session and roadmap."""
+    return st.session_state.gemini_client.get_roadmaps_and_progress(roadmap_id)
+
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _cached_progress(roadmap_id):
+    """Return progress statistics for a roadmap, cached per roadmap ID."""
+    return st.session_state.gemini_client.get_roadmap_progress(roadmap_id)
+
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _cached_progress_counts(roadmap_id):
+    """Return progress counts for a roadmap without its items, cached per roadmap ID."""
+    return st.session_state.gemini_client.get_roadmap_progress_counts(roadmap_id)
+
+
+def _scan_mermaid_nodes(body, start, end):
+    """Collect (node_id, label) pairs for A[Label]-style nodes in body[start:end].
+
+    Same results as findall(r'([A-Z]\\w*)\\[([^\\]]+)\\]') on that slice.
+    """
+    nodes = []
+    last_end = start
+    i = body.find("[", start, end)
+    while i >= 0:
+        # Node IDs are the word characters right before the bracket, from the first capital
+        s = i
+        while s > last_end and (body[s - 1].isalnum() or body[s - 1] == "_"):
+            s -= 1
+        node_start = next((p for p in range(s, i) if "A" <= body[p] <= "Z"), -1)
+        close = body.find("]", i + 1, end)
+        if close < 0:
+            break
+        if node_start >= 0 and close > i + 1:
+            nodes.append((body[node_start:i], body[i + 1:close]))
+            last_end = close + 1
+            i = body.find("[", last_end, end)
+        else:
+            i = body.find("[", i + 1, end)
+    return nodes
+
+
+def _split_mermaid(text):
+    """Split ```mermaid fenced blocks out of text with plain string scans.
+
+    Returns ``(blocks, remaining_text)`` where each block is
+    ``(diagram, nodes)``. Equivalent to matching
+    ```\\s*mermaid\\s*\\n(.*?)\\n``` but without running the regex engine;
+    node labels are picked up while each block is cut out.
+    """
+    blocks = []
+    remaining = []
+    start = 0
+    i = 0
+    while True:
+        j = text.find("```", i)
+        if j < 0:
+            break
+        k = j + 3
+        while k < len(text) and text[k].isspace():
+            k += 1
+        if not text.startswith("mermaid", k):
+            i = j + 1
+            continue
+        w = k + 7
+        while w < len(text) and text[w].isspace():
+            w += 1
+        # The body starts after the last newline in the whitespace following the tag
+        nl = text.rfind("\n", k + 7, w)
+        if nl < 0:
+            i = j + 1
+            continue
+        end = text.find("\n```", nl + 1)
+        if end < 0:
+            # An empty body still matches when the whitespace run ends in the closing fence
+            prev_nl = text.rfind("\n", k + 7, nl)
+            if prev_nl < 0 or not text.startswith("```", nl + 1):
+                break
+            nl, end = prev_nl, nl
+        blocks.append((text[nl + 1:end], _scan_mermaid_nodes(text, nl + 1, end)))
+        remaining.append(text[start:j])
+        start = i = end + 4
+    remaining.append(text[start:])
+    return blocks, "".join(remaining)
+
+
 # Sidebar for settings
-with st.sidebar:
+@st.fragment
+def _settings_panel():
+    """Render the study settings; edits rerun only this panel, not the chat."""
     st.header("⚙️ Study Settings")
     
     # Study Field
@@ -60,20 +173,16 @@ with st.sidebar:
     # Current Level
     current_level = st.selectbox(
         "Current Level",
-        ["Beginner", "Intermediate", "Advanced"],
-        index=["Beginner", "Intermediate", "Advanced"].index(
-            st.session_state.settings.get("current_level", "Beginner")
-        ),
+        _LEVELS,
+        index=_LEVELS.index(st.session_state.settings.get("current_level", "Beginner")),
         help="Select your current proficiency level"
     )
     
     # Duration
     duration = st.selectbox(
         "Study Duration",
-        ["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom"],
-        index=["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom"].index(
-            st.session_state.settings.get("duration", "3 weeks")
-        ) if st.session_state.settings.get("duration", "3 weeks") in ["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months"] else 7,
+        _DURATIONS,
+        index=_DURATION_INDEX.get(st.session_state.settings.get("duration", "3 weeks"), len(_DURATIONS) - 1),
         help="Select your desired study timeline"
     )
     
@@ -93,6 +202,10 @@ with st.sidebar:
         "current_level": current_level,
         "study_field": study_field
     }
+
+
+with st.sidebar:
+    _settings_panel()
     
     st.divider()
     
@@ -100,6 +213,9 @@ with st.sidebar:
     if st.button("🔄 Reset Conversation", use_container_width=True):
         st.session_state.messages = []
         st.session_state.gemini_client.reset_conversation()
+        # Drop the cached roadmap lists so the sidebar and tracker don't show the old ones
+        _cached_roadmaps.clear()
+        _cached_tracker.clear()
         st.rerun()
     
     st.divider()
@@ -123,76 +239,98 @@ if prompt := st.chat_input("Ask for a study plan or ask questions about your lea
     
     # Generate response
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                # Get response with user settings
-                response = st.session_state.gemini_client.chat(
-                    prompt,
-                    session_id=st.session_state.session_id,
-                    user_settings=st.session_state.settings
-                )
-                
-                # Process response to handle Mermaid diagrams
-                # Extract Mermaid diagrams - handle multiple formats
-                mermaid_pattern = r'```mermaid\s*\n(.*?)\n```'
-                mermaid_diagrams = re.findall(mermaid_pattern, response, re.DOTALL)
-                
-                # Also try alternative format with space
-                if not mermaid_diagrams:
-                    mermaid_pattern = r'```\s*mermaid\s*\n(.*?)\n```'
-                    mermaid_diagrams = re.findall(mermaid_pattern, response, re.DOTALL)
+        try:
+            # Stream the response with user settings into a placeholder;
+            # Mermaid blocks are only collected here and rendered after the stream ends
+            stream_placeholder = st.empty()
+            collected = []
+            with stream_placeholder.container():
+                st.write_stream(stream_without_mermaid(
+                    st.session_state.gemini_client.chat_stream(
+                        prompt,
+                        session_id=st.session_state.session_id,
+                        user_settings=st.session_state.settings
+                    ),
+                    collected,
+                    _MERMAID_RE_OPEN
+                ))
+            response = "".join(collected)
+            
+            # Process response to handle Mermaid diagrams
+            # Plain-text answers have no code fence, so skip the regex scans entirely
+            # and keep the streamed text as it is
+            has_fence = "```" in response
+            if has_fence:
+                # Replace the streamed text with the diagram layout below
+                stream_placeholder.empty()
                 
-                # Save roadmap if one was generated
-                if mermaid_diagrams and gemini_client.use_database:
+                # Extract Mermaid diagrams and remove their code blocks for cleaner display
+                mermaid_blocks, response_without_mermaid = _split_mermaid(response)
+                mermaid_diagrams = [diagram for diagram, _ in mermaid_blocks]
+            else:
+                mermaid_blocks = []
+                mermaid_diagrams = []
+            
+            # Save roadmap if one was generated and not already stored this session
+            if mermaid_diagrams and st.session_state.gemini_client.use_database:
+                diagram_hash = hash(mermaid_diagrams[0])
+                saved_hashes = st.session_state.setdefault("_saved_roadmap_hashes", set())
+                if diagram_hash not in saved_hashes:
                     try:
                         # Extract title from user message or use default
-                        roadmap_title = user_message[:50] + "..." if len(user_message) > 50 else user_message
-                        gemini_client.save_roadmap(roadmap_title, mermaid_diagrams[0])
+                        roadmap_title = prompt[:50] + "..." if len(prompt) > 50 else prompt
+                        if st.session_state.gemini_client.save_roadmap(roadmap_title, *mermaid_blocks[0]):
+                            saved_hashes.add(diagram_hash)
+                            _cached_roadmaps.clear()
+                            _cached_tracker.clear()
                     except Exception as e:
                         st.warning(f"Could not save roadmap: {e}")
-                
-                # Remove Mermaid code blocks from response for cleaner display
-                response_without_mermaid = re.sub(r'```\s*mermaid\s*\n.*?\n```', '', response, flags=re.DOTALL)
-                
-                # Display Mermaid diagrams first if any exist
-                if mermaid_diagrams:
-                    st.subheader("📊 Study Roadmap Diagram")
-                    st.markdown("---")
-                    for idx, diagram in enumerate(mermaid_diagrams):
-                        # Clean up the diagram code
-                        diagram_clean = diagram.strip()
-                        
-                        # Display the Mermaid diagram using st_mermaid
-                        try:
-                            st_mermaid(diagram_clean, height=500)
-                        except Exception as e:
-                            st.warning(f"Could not render diagram {idx+1}. Showing code instead.")
-                            st.code(diagram_clean, language="mermaid")
-                        
-                        # Also show the code for reference
-                        with st.expander(f"📝 View Diagram Code {idx+1}"):
-                            st.code(diagram_clean, language="mermaid")
+            
+            # Display Mermaid diagrams first if any exist
+            if mermaid_diagrams:
+                st.subheader("📊 Study Roadmap Diagram")
+                st.markdown("---")
+                for idx, diagram in enumerate(mermaid_diagrams):
+                    # Clean up the diagram code
+                    diagram_clean = diagram.strip()
+                    
+                    # Display the Mermaid diagram using st_mermaid
+                    try:
+                        st_mermaid(diagram_clean, height=500)
+                    except Exception as e:
+                        st.warning(f"Could not render diagram {idx+1}. Showing code instead.")
+                        st.code(diagram_clean, language="mermaid")
                     
-                    st.markdown("---")
+                    # Also show the code for reference
+                    with st.expander(f"📝 View Diagram Code {idx+1}"):
+                        st.code(diagram_clean, language="mermaid")
                 
-                # Display response text after diagrams
+                st.markdown("---")
+            
+            # Display response text after diagrams
+            if has_fence:
                 st.markdown(response_without_mermaid)
-                
-                # Add assistant response to messages
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                
-            except Exception as e:
-                error_message = f"Error: {str(e)}"
-                st.error(error_message)
-                st.session_state.messages.append({"role": "assistant", "content": error_message})
+            
+            # Add assistant response to messages
+            st.session_state.messages.append({"role": "assistant", "content": response})
+            
+        except Exception as e:
+            error_message = f"Error: {str(e)}"
+            st.error(error_message)
+            st.session_state.messages.append({"role": "assistant", "content": error_message})
 
 # Progress Tracking Section
-if st.session_state.get("db_initialized", False):
-    st.divider()
-    st.header("📈 Learning Progress Tracker")
-    
+@st.fragment
+def _progress_tracker():
+    """Render the progress tracker; checkbox toggles only rerun this fragment."""
     try:
-        roadmaps = st.session_state.gemini_client.get_roadmaps()
+        # When the selected roadmap is already known, fetch the list and its progress together
+        previous_roadmap_id = st.session_state.get("roadmap_selector")
+        prefetched_progress = None
+        if previous_roadmap_id and st.session_state.get("show_roadmap_items", True):
+            roadmaps, prefetched_progress = _cached_tracker(st.session_state.session_id, previous_roadmap_id)
+        else:
+            roadmaps = _cached_roadmaps(st.session_state.session_id)
         
         if roadmaps:
             # Roadmap selector
@@ -205,8 +343,15 @@ if st.session_state.get("db_initialized", False):
             )
             
             if selected_roadmap_id:
-                # Get progress data
-                progress_data = st.session_state.gemini_client.get_roadmap_progress(selected_roadmap_id)
+                show_items = st.toggle("Show roadmap items", value=True, key="show_roadmap_items")
+                
+                # Get progress data; the counts-only query is enough when the checklist is hidden
+                if show_items and prefetched_progress is not None and selected_roadmap_id == previous_roadmap_id:
+                    progress_data = prefetched_progress
+                elif show_items:
+                    progress_data = _cached_progress(selected_roadmap_id)
+                else:
+                    progress_data = _cached_progress_counts(selected_roadmap_id)
                 
                 # Progress overview
                 col1, col2, col3 = st.columns(3)
@@ -220,33 +365,50 @@ if st.session_state.get("db_initialized", False):
                 # Progress bar
                 st.progress(progress_data["progress_percentage"] / 100)
                 
-                # Items checklist
-                st.subheader("📝 Roadmap Items")
-                for item in progress_data["items"]:
-                    completed = item.get("completed", False)
-                    item_title = item.get("title", "Unknown")
-                    
-                    # Checkbox for completion
-                    new_completed = st.checkbox(
-                        item_title,
-                        value=completed,
-                        key=f"item_{item['id']}"
-                    )
+                if show_items:
+                    # Items checklist
+                    st.subheader("📝 Roadmap Items")
+                    changes = {}
+                    for item in progress_data["items"]:
+                        completed = item.get("completed", False)
+                        item_title = item.get("title", "Unknown")
+                        
+                        # Checkbox for completion
+                        new_completed = st.checkbox(
+                            item_title,
+                            value=completed,
+                            key=f"item_{item['id']}"
+                        )
+                        
+                        # Collect changes and apply them in a single batch below
+                        if new_completed != completed:
+                            changes[item["id"]] = new_completed
                     
-                    # Update progress if changed
-                    if new_completed != completed:
-                        success = st.session_state.gemini_client.update_item_progress(item["id"], new_completed)
+                    # Update progress if anything changed
+                    if changes:
+                        success = st.session_state.gemini_client.bulk_update_items(
+                            [{"id": item_id, "completed": value} for item_id, value in changes.items()]
+                        )
                         if success:
-                            st.success(f"✅ Updated: {item_title}")
-                            st.rerun()  # Refresh to show updated progress
+                            _cached_progress.clear()
+                            _cached_progress_counts.clear()
+                            _cached_tracker.clear()
+                            st.success(f"✅ Updated {len(changes)} item(s)")
+                            st.rerun(scope="fragment")  # Refresh to show updated progress
                         else:
-                            st.error(f"❌ Failed to update: {item_title}")
+                            st.error(f"❌ Failed to update {len(changes)} item(s)")
         else:
             st.info("📚 No roadmaps found. Generate a study plan to start tracking progress!")
             
     except Exception as e:
         st.error(f"Error loading progress tracker: {e}")
 
+
+if st.session_state.get("db_initialized", False):
+    st.divider()
+    st.header("📈 Learning Progress Tracker")
+    _progress_tracker()
+
 # Footer
 st.divider()
 st.caption("🔍 Use 'search:' or '/search' prefix to search the web for resources")
@@ -1,15 +1,164 @@
 # front.py - Streamlit Application avec multi-pages
 import streamlit as st
-from streamlit_mermaid import st_mermaid
-import uuid
+import functools
 import os
+import pickle
+import uuid
 import re
-from dotenv import load_dotenv
-from backend.gemini_client import GeminiClient
+import hashlib
+from collections import OrderedDict
+from backend.streaming import stream_without_mermaid
+
+
+@st.cache_resource(show_spinner=False)
+def _load_env():
+    """Load the .env file and set up logging once per process instead of on every script rerun."""
+    from backend.gemini_client import init_env
+    from backend.log_config import setup_logging
+    init_env()
+    setup_logging()
+
+
+# Mermaid patterns, compiled once instead of on every rendered message
+# Any fenced block in one scan: ```mermaid blocks, or ``` / ~~~ blocks with their language label
+_RE_ANY_FENCE = re.compile(
+    r'```\s*mermaid\s*(?P<mermaid>.*?)\s*```'
+    r'|(?P<fence>```|~~~)(?P<lang>\w*)\s*(?P<body>.*?)\s*(?P=fence)',
+    re.DOTALL | re.IGNORECASE
+)
+# Opening fence of a Mermaid block, watched for while a response streams
+_RE_MERMAID_OPEN = re.compile(r'```\s*mermaid', re.IGNORECASE)
+_RE_INLINE_MERMAID = re.compile(r'(?:(?:^|\n)(?:flowchart|graph)[\s\S]*?)(?=\n{2,}|$)', re.IGNORECASE)
+_RE_STRIP_FENCE = re.compile(r'^```\w*|```$')
+# Case-insensitive keyword checks, so cleaning never builds a lowercased copy
+_RE_MERMAID_HEAD = re.compile(r'flowchart|graph|sequence|gantt', re.IGNORECASE)
+# A diagram header further in: the keyword must open a line, so "paragraph" never matches
+_RE_MERMAID_ANY = re.compile(r'^[ \t]*(flowchart|graph)\b', re.IGNORECASE | re.MULTILINE)
+_RE_CLASSDEF = re.compile(r'classdef', re.IGNORECASE)
+# Smart quotes and non-breaking spaces Mermaid can't parse, replaced in one pass
+_SMART_QUOTES = str.maketrans({'\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'", '\u00A0': ' '})
+
+# Sidebar choices and their selectbox indexes, built once instead of on every rerun
+_LEVELS = ("Beginner", "Intermediate", "Advanced")
+_LEVEL_INDEX = {level: i for i, level in enumerate(_LEVELS)}
+_DURATIONS = ("1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom")
+# "Custom" is left out so any free-text duration falls back to it
+_DURATION_INDEX = {d: i for i, d in enumerate(_DURATIONS[:-1])}
+
+# Default roadmap classes, added to diagrams that use ':::' without defining them
+_COLOR_DEFS = (
+    "classDef foundation fill:#4d94ff,color:#000,stroke:#333,stroke-width:2px\n"
+    "classDef core fill:#33cc33,color:#000,stroke:#333,stroke-width:2px\n"
+    "classDef practice fill:#ff9900,color:#000,stroke:#333,stroke-width:2px\n"
+    "classDef project fill:#9933ff,color:#fff,stroke:#333,stroke-width:2px\n"
+    "classDef review fill:#ff3333,color:#fff,stroke:#333,stroke-width:2px"
+)
+
+# CDN fallback page for one diagram; JS braces are doubled for str.format
+_MERMAID_HTML_TMPL = """<!doctype html>
+<html><head><meta charset="utf-8"> 
+    <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
+    <style>.mermaid{{background:transparent}}</style>
+</head>
+<body>
+    <div id="{wrapper_id}"> <div class="mermaid">{diagram}</div> </div>
+    <script>
+        try {{
+            mermaid.initialize({{ startOnLoad: false, securityLevel: 'loose' }});
+            mermaid.init(undefined, document.querySelectorAll('#{wrapper_id} .mermaid'));
+        }} catch(err) {{
+            console.error('mermaid init error', err);
+        }}
+    </script>
+</body></html>"""
+
+# Page styles, a module constant so the string is built once per process
+_CSS = """
+    <style>
+    .toolbar {
+        background-color: #f0f2f6;
+        padding: 10px 20px;
+        border-radius: 10px;
+        margin-bottom: 20px;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+    
+    /* Ensure Mermaid diagrams are visible */
+    .mermaid {
+        background-color: #f8f9fa !important;
+        padding: 15px !important;
+        border-radius: 8px !important;
+        border: 1px solid #dee2e6 !important;
+    }
+    
+    /* Make sure text in Mermaid nodes is readable */
+    .mermaid .nodeLabel {
+        color: #000000 !important;
+        font-weight: 500 !important;
+    }
+    </style>
+"""
+
+# Chats saved between page reloads when there is no database, one pickle per session
+_SESSION_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+_SESSION_KEYS = ("messages", "response_cache", "user_count", "diagrams_count")
+# Replies kept per session, least recently used dropped first, since the whole
+# cache is pickled again on every turn
+_RESPONSE_CACHE_SIZE = 50
+# Web search prompts, never cached so stale results aren't replayed (as in the backend)
+_RE_SEARCH_PROMPT = re.compile(r'\s*(?:search(?:-all)?:|/search)', re.IGNORECASE)
+
+
+_SESSION_COOKIE = "study_planner_sid"
+
+
+def _session_id_from_cookie():
+    """Reuse the browser's session cookie, so a reload finds the saved chat.
+
+    The id is kept in a SameSite cookie rather than the URL, so sharing or
+    bookmarking a link never hands the chat to someone else.
+    """
+    try:
+        # Only well-formed UUIDs, since the id becomes a file name
+        return str(uuid.UUID(st.context.cookies.get(_SESSION_COOKIE, "")))
+    except ValueError:
+        session_id = str(uuid.uuid4())
+    import streamlit.components.v1 as components
+    components.html(
+        f"<script>document.cookie = '{_SESSION_COOKIE}={session_id}; path=/; "
+        f"max-age=2592000; SameSite=Strict';</script>",
+        height=0
+    )
+    return session_id
+
+
+def _session_cache_path(session_id):
+    return os.path.join(_SESSION_CACHE_DIR, f"{session_id}.pkl")
+
+
+def _load_session(session_id):
+    """Return the state saved for a session, or None if there is none."""
+    try:
+        with open(_session_cache_path(session_id), "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _save_session():
+    """Write the chat to disk; Supabase already keeps it when the database is on."""
+    if st.session_state.gemini_client.use_database:
+        return
+    path = _session_cache_path(st.session_state.session_id)
+    try:
+        os.makedirs(_SESSION_CACHE_DIR, exist_ok=True)
+        # Write then rename, so a crash mid-write can't leave a truncated file
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump({key: st.session_state[key] for key in _SESSION_KEYS}, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        st.warning(f"Could not save the conversation: {e}")
 
-# Load environment variables
-env_path = os.path.join(os.path.dirname(__file__), 'backend', '.env')
-load_dotenv(env_path)
 
 # Page configuration
 st.set_page_config(
@@ -19,12 +168,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize session state
+# Initialize session state; the backend is only imported when a new session needs a client
 if "gemini_client" not in st.session_state:
     try:
+        _load_env()
+        from backend.gemini_client import GeminiClient
         st.session_state.gemini_client = GeminiClient()
-        st.session_state.session_id = str(uuid.uuid4())
         st.session_state.messages = []
+        # Responses by hash of prompt, settings and the chat so far, so a prompt
+        # repeated at the same point of a conversation skips Gemini
+        st.session_state.response_cache = OrderedDict()
+        # Home page metrics, updated as messages are added instead of recounted each rerun
+        st.session_state.user_count = 0
+        st.session_state.diagrams_count = 0
+        if st.session_state.gemini_client.use_database:
+            st.session_state.session_id = str(uuid.uuid4())
+        else:
+            st.session_state.session_id = _session_id_from_cookie()
+            saved = _load_session(st.session_state.session_id)
+            if saved:
+                for key in _SESSION_KEYS:
+                    st.session_state[key] = saved.get(key, st.session_state[key])
+                # Sessions saved before the cache was bounded hold a plain dict
+                st.session_state.response_cache = OrderedDict(
+                    list(st.session_state.response_cache.items())[-_RESPONSE_CACHE_SIZE:]
+                )
+                st.session_state.gemini_client.restore_history(st.session_state.messages)
         st.session_state.settings = {
             "duration": "3 weeks",
             "current_level": "Beginner",
@@ -47,31 +216,10 @@ if not st.session_state.get("db_initialized", False) and not st.session_state.ge
     st.session_state.db_warning_shown = True
 
 # ==================== STYLES ====================
-st.markdown("""
-    <style>
-    .toolbar {
-        background-color: #f0f2f6;
-        padding: 10px 20px;
-        border-radius: 10px;
-        margin-bottom: 20px;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-    
-    /* Ensure Mermaid diagrams are visible */
-    .mermaid {
-        background-color: #f8f9fa !important;
-        padding: 15px !important;
-        border-radius: 8px !important;
-        border: 1px solid #dee2e6 !important;
-    }
-    
-    /* Make sure text in Mermaid nodes is readable */
-    .mermaid .nodeLabel {
-        color: #000000 !important;
-        font-weight: 500 !important;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# Re-sent on full reruns only: Streamlit drops elements a run doesn't emit, so
+# gating this on a session flag would unstyle the page after the first rerun.
+# Chat and sidebar interactions rerun their fragments and skip it entirely.
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # ==================== NAVIGATION ====================
 pages = {
@@ -88,184 +236,163 @@ with col2:
     toolbar_nav = st.container()
     with toolbar_nav:
         cols = st.columns(len(pages))
-        for idx, (page_name, page_id) in enumerate(pages.items()):
-            with cols[idx]:
-                if st.button(page_name, key=f"toolbar_{page_id}", 
-                           use_container_width=True,
-                           type="primary" if st.session_state.active_page == page_name else "secondary"):
-                    st.session_state.active_page = page_name
-                    st.rerun()
-
-# ==================== SIDEBAR ====================
-with st.sidebar:
-    st.header("⚙️ Study Settings")
-    st.markdown("---")
-    
-    study_field = st.text_input(
-        "Study Field/Topic",
-        value=st.session_state.settings.get("study_field", ""),
-        placeholder="e.g., Python, Machine Learning, Java",
-        help="Enter the subject you want to study"
-    )
-    
-    current_level = st.selectbox(
-        "Current Level",
-        ["Beginner", "Intermediate", "Advanced"],
-        index=["Beginner", "Intermediate", "Advanced"].index(
-            st.session_state.settings.get("current_level", "Beginner")
-        ),
-        help="Select your current proficiency level"
-    )
-    
-    duration = st.selectbox(
-        "Study Duration",
-        ["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom"],
-        index=["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months", "Custom"].index(
-            st.session_state.settings.get("duration", "3 weeks")
-        ) if st.session_state.settings.get("duration", "3 weeks") in ["1 week", "2 weeks", "3 weeks", "1 month", "2 months", "3 months", "6 months"] else 7,
-        help="Select your desired study timeline"
-    )
-    
-    if duration == "Custom":
-        custom_duration = st.text_input(
-            "Custom Duration",
-            placeholder="e.g., 5 weeks, 10 days",
-            help="Enter a custom duration"
-        )
-        if custom_duration:
-            duration = custom_duration
-    
-    st.session_state.settings = {
-        "duration": duration,
-        "current_level": current_level,
-        "study_field": study_field
-    }
-    
-    
-  
-    
-    if st.button("🔄 Reset Conversation", use_container_width=True, help="Reset conversation"):
-        st.session_state.gemini_client.reset_conversation()
-        st.session_state.last_raw_response = None
-        st.session_state.messages = []
-        st.rerun()
-
-    if st.button("🔧 Render Mermaid Test", use_container_width=True, help="Render a simple test Mermaid diagram to debug rendering"):
-        test_diagram = """graph TD
-    A[Test Start] --> B[Test End]
-    style A fill:#4d94ff
-    style B fill:#33cc33"""
-        display_message(test_diagram)
-    
-    st.markdown("---")
-    st.caption("💡 **Tip:** Set your study preferences before asking for a plan!")
+        # Call button() on each column directly rather than entering a `with` block per page
+        clicked = [
+            cols[idx].button(page_name, key=f"toolbar_{page_id}",
+                             use_container_width=True,
+                             type="primary" if st.session_state.active_page == page_name else "secondary")
+            for idx, (page_name, page_id) in enumerate(pages.items())
+        ]
+        for was_clicked, page_name in zip(clicked, pages):
+            if was_clicked:
+                st.session_state.active_page = page_name
+                st.rerun()
 
 # ==================== UTILITY FUNCTIONS ====================
 
-def extract_mermaid_diagrams(response_text):
-    """Extract Mermaid diagrams from response text - FIXED VERSION"""
-    diagrams = []
-
+def _looks_like_mermaid(code):
+    """Whether an unlabelled code block reads like a Mermaid diagram."""
+    low = code.lower()
+    return ('flowchart' in low or 'graph' in low or 'classdef' in low
+            or '-->' in code or ('[' in code and ']' in code))
+
+# The helpers below are pure str -> value functions, memoised because
+# every rerun passes them the same messages again
+@functools.lru_cache(maxsize=256)
+def _find_diagrams(response_text):
+    """Locate the Mermaid diagrams of a message as (start, end, code) tuples.
+
+    extract_mermaid_diagrams and remove_mermaid_blocks both use it, so what is
+    rendered as a diagram is exactly what is cut from the text.
+    """
     if not response_text:
-        return diagrams
-
-    # 1) Explicit fenced mermaid blocks (```mermaid ... ```) - case-insensitive
-    matches = re.findall(r'```\s*mermaid\s*(.*?)\s*```', response_text, re.DOTALL | re.IGNORECASE)
-    for m in matches:
-        if m and m.strip():
-            diagrams.append(m.strip())
-
-    # 2) Generic fenced code blocks (```...``` or ~~~...~~~) that look like mermaid
-    if not diagrams:
-        fenced = re.findall(r'```(?:\w+)?\s*(.*?)\s*```', response_text, re.DOTALL)
-        fenced += re.findall(r'~~~\s*(.*?)\s*~~~', response_text, re.DOTALL)
-        for code in fenced:
-            c = code.strip()
-            if not c:
+        return ()
+
+    # Plain-text answers have no fence and no flowchart/graph keyword; skip the regexes
+    low = response_text.lower()
+    if not ('```' in response_text or '~~~' in response_text or 'flowchart' in low or 'graph' in low):
+        return ()
+
+    # One sweep over all fenced blocks, classified by their label
+    labelled, unlabelled, fences = [], [], []
+    for match in _RE_ANY_FENCE.finditer(response_text):
+        start, end = match.span()
+        fences.append((start, end))
+        if match.group("mermaid") is not None:
+            code, is_mermaid = match.group("mermaid").strip(), True
+        else:
+            lang, code = match.group("lang"), match.group("body").strip()
+            is_mermaid = lang.lower() == "mermaid"
+            if lang.lower() in ("flowchart", "graph"):
+                # ```graph TD - the diagram keyword was read as the label
+                code = f"{lang} {code}"
+            elif lang and not is_mermaid:
+                # Python, shell, etc. snippets are code, never a diagram
                 continue
-            low = c.lower()
-            if ('flowchart' in low or 'graph' in low or 'classdef' in low
-                    or '-->' in c or ('[' in c and ']' in c)):
-                diagrams.append(c)
+        if not code:
+            continue
+        # 1) Explicit fenced mermaid blocks (```mermaid ... ```) - case-insensitive
+        if is_mermaid:
+            labelled.append((start, end, code))
+        # 2) Unlabelled fenced code blocks (```...``` or ~~~...~~~) that look like mermaid
+        elif not labelled and _looks_like_mermaid(code):
+            unlabelled.append((start, end, code))
+    if labelled or unlabelled:
+        return tuple(labelled or unlabelled)
 
     # 3) Inline/raw mermaid blocks (no fences) - look for blocks starting with flowchart/graph
-    if not diagrams:
-        inline = re.findall(r'(?:(?:^|\n)(?:flowchart|graph)[\s\S]*?)(?=\n{2,}|$)', response_text, re.IGNORECASE)
-        for block in inline:
-            b = block.strip()
-            if b:
-                diagrams.append(b)
+    inline = []
+    for match in _RE_INLINE_MERMAID.finditer(response_text):
+        code = match.group(0).strip()
+        if code and not any(fence_start <= match.start() < fence_end for fence_start, fence_end in fences):
+            inline.append((match.start(), match.end(), code))
+    return tuple(inline)
+
+@functools.lru_cache(maxsize=256)
+def extract_mermaid_diagrams(response_text):
+    """Extract Mermaid diagrams from response text - FIXED VERSION
 
-    return diagrams
+    Returns a tuple so callers can't mutate the cached result.
+    """
+    return tuple(code for _, _, code in _find_diagrams(response_text))
 
+@functools.lru_cache(maxsize=256)
 def validate_and_clean_mermaid(diagram_code):
     """Clean and validate Mermaid diagram code before rendering."""
     if not diagram_code:
         return None
     # Strip any surrounding fences/backticks
-    cleaned = re.sub(r'^```\w*|```$', '', diagram_code).strip()
+    cleaned = _RE_STRIP_FENCE.sub('', diagram_code).strip()
 
     # Replace common smart-quotes and non-breaking spaces
-    cleaned = cleaned.replace('\u201c', '"').replace('\u201d', '"')
-    cleaned = cleaned.replace('\u2018', "'").replace('\u2019', "'")
-    cleaned = cleaned.replace('\u00A0', ' ')
+    cleaned = cleaned.translate(_SMART_QUOTES)
 
-    # Remove leading blockquote markers and trim each line
-    lines = [ln.lstrip('> ').rstrip() for ln in cleaned.split('\n')]
-    lines = [ln for ln in lines if ln and not ln.startswith('%% mermaid')]
-    cleaned = '\n'.join(lines).strip()
-
-    low = cleaned.lower()
+    # Remove leading blockquote markers and trim each line, in one pass without intermediate lists
+    stripped = (ln.lstrip('> ').rstrip() for ln in cleaned.splitlines())
+    cleaned = '\n'.join(ln for ln in stripped if ln and not ln.startswith('%% mermaid')).strip()
 
     # Ensure it starts with a recognized mermaid block type; if not, try to extract or prepend
-    if not (low.startswith('flowchart') or low.startswith('graph') or low.startswith('sequence') or low.startswith('gantt')):
-        if 'flowchart' in low:
-            idx = low.find('flowchart')
-            cleaned = cleaned[idx:]
-        elif 'graph' in low:
-            idx = low.find('graph')
-            cleaned = cleaned[idx:]
+    if not _RE_MERMAID_HEAD.match(cleaned):
+        keyword = _RE_MERMAID_ANY.search(cleaned)
+        if keyword:
+            cleaned = cleaned[keyword.start(1):]
         else:
             cleaned = f"flowchart TD\n{cleaned}"
 
     # Add default class definitions when ':::' used but no classDef present
-    if 'classdef' not in low and ':::' in cleaned:
-        color_defs = (
-            "classDef foundation fill:#4d94ff,color:#000,stroke:#333,stroke-width:2px\n"
-            "classDef core fill:#33cc33,color:#000,stroke:#333,stroke-width:2px\n"
-            "classDef practice fill:#ff9900,color:#000,stroke:#333,stroke-width:2px\n"
-            "classDef project fill:#9933ff,color:#fff,stroke:#333,stroke-width:2px\n"
-            "classDef review fill:#ff3333,color:#fff,stroke:#333,stroke-width:2px"
-        )
-        parts = cleaned.split('\n')
-        if len(parts) > 0:
-            parts.insert(1, color_defs)
-            cleaned = '\n'.join(parts)
+    if ':::' in cleaned and not _RE_CLASSDEF.search(cleaned):
+        # Splice in after the first line by slicing, without splitting into lines
+        nl = cleaned.find('\n')
+        if nl >= 0:
+            cleaned = f"{cleaned[:nl + 1]}{_COLOR_DEFS}\n{cleaned[nl + 1:]}"
+        else:
+            cleaned = f"{cleaned}\n{_COLOR_DEFS}"
 
     return cleaned
 
+@functools.lru_cache(maxsize=256)
 def remove_mermaid_blocks(response_text):
     """Remove all Mermaid code blocks from response text."""
-    # First remove explicit mermaid blocks
-    pattern1 = r'```mermaid\s*.*?\s*```'
-    cleaned = re.sub(pattern1, '', response_text, flags=re.DOTALL)
-    
-    # Then remove any remaining code blocks that might be mermaid
-    pattern2 = r'```\s*.*?\s*```'
-    cleaned = re.sub(pattern2, '', cleaned, flags=re.DOTALL)
-    
-    return cleaned.strip()
+    # Cut out exactly the diagrams extract_mermaid_diagrams finds; other code stays
+    pieces, pos = [], 0
+    for start, end, _ in _find_diagrams(response_text):
+        pieces.append(response_text[pos:start])
+        pos = end
+    pieces.append(response_text[pos:])
+    return ''.join(pieces).strip()
+
+def _add_message(role, content):
+    """Append a chat message and keep the home page counters in step."""
+    st.session_state.messages.append({"role": role, "content": content})
+    if role == "user":
+        st.session_state.user_count += 1
+    elif extract_mermaid_diagrams(content):
+        st.session_state.diagrams_count += 1
+
+@st.cache_data(show_spinner=False)
+def _prepare_message(message_content):
+    """Split a message into its text, its diagrams and the cleaned first diagram.
+
+    Cached per message so reruns don't re-parse the whole chat history.
+    """
+    diagrams = extract_mermaid_diagrams(message_content)
+    text_content = remove_mermaid_blocks(message_content)
+    diagram_clean = validate_and_clean_mermaid(diagrams[0]) if diagrams else None
+    return text_content, diagrams, diagram_clean
+
+def display_message(message_content, position=None):
+    """Display a single message with Mermaid diagram handling - FIXED VERSION
 
-def display_message(message_content):
-    """Display a single message with Mermaid diagram handling - FIXED VERSION"""
+    position tells apart identical messages shown on the same page. Returns the
+    diagrams found, so callers don't extract them a second time.
+    """
     # Store for debugging
     st.session_state.last_raw_response = message_content
     
-    # Extract diagrams
-    diagrams = extract_mermaid_diagrams(message_content)
+    # Extract diagrams and the text content without them
+    text_content, diagrams, diagram_clean = _prepare_message(message_content)
     
     # Display text content without diagrams
-    text_content = remove_mermaid_blocks(message_content)
     if text_content:
         st.markdown(text_content)
     
@@ -276,98 +403,150 @@ def display_message(message_content):
         
         # Take the first diagram
         diagram_raw = diagrams[0]
-        diagram_clean = validate_and_clean_mermaid(diagram_raw)
         
         if not diagram_clean:
             st.error("❌ Could not parse Mermaid diagram")
             st.code(diagram_raw[:500], language="text")
         else:
-                        try:
-                                # Prefer rendering via an HTML component using the Mermaid CDN for reliability
-                                import time
-                                unique_key = f"mermaid_{int(time.time() * 1000)}"
-                                import streamlit.components.v1 as components
-
-                                # Use a wrapper div id so multiple diagrams don't clash
-                                wrapper_id = f"{unique_key}_wrap"
-                                html = f"""<!doctype html>
-<html><head><meta charset=\"utf-8\"> 
-    <script src=\"https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js\"></script>
-    <style>.mermaid{{background:transparent}}</style>
-</head>
-<body>
-    <div id=\"{wrapper_id}\"> <div class=\"mermaid\">{diagram_clean}</div> </div>
-    <script>
-        try {{
-            mermaid.initialize({{ startOnLoad: false, securityLevel: 'loose' }});
-            mermaid.init(undefined, document.querySelectorAll('#{wrapper_id} .mermaid'));
-        }} catch(err) {{
-            console.error('mermaid init error', err);
-        }}
-    </script>
-</body></html>"""
+            # Content-based key, so reruns reuse the rendered diagram
+            unique_key = f"mermaid_{hashlib.md5(diagram_clean.encode()).hexdigest()[:12]}"
+            if position is not None:
+                unique_key = f"{unique_key}_{position}"
 
-                                components.html(html, height=420, scrolling=True)
-                                st.success("✅ Diagram displayed")
+            try:
+                # st_mermaid serves its bundled Mermaid script once per session
+                from streamlit_mermaid import st_mermaid
+                st_mermaid(diagram_clean, key=unique_key, height=400)
+                st.success("✅ Diagram displayed")
 
-                                # Show the code
-                                with st.expander("📝 View Diagram Code"):
-                                        st.code(diagram_clean, language="mermaid")
+                # Show the code
+                with st.expander("📝 View Diagram Code"):
+                    st.code(diagram_clean, language="mermaid")
 
-                        except Exception as e:
-                                st.error(f"❌ Mermaid rendering error: {str(e)}")
+            except Exception as e:
+                st.error(f"❌ Mermaid rendering error: {str(e)}")
 
-                                # Show debug info
-                                with st.expander("🔍 Debug: Raw Diagram Code"):
-                                        st.code(diagram_clean, language="mermaid")
+                # Show debug info
+                with st.expander("🔍 Debug: Raw Diagram Code"):
+                    st.code(diagram_clean, language="mermaid")
 
-                                # As a last resort, attempt st_mermaid if available
-                                try:
-                                        st.info("Attempting fallback with `st_mermaid` component...")
-                                        st_mermaid(diagram_clean, key=unique_key, height=400)
-                                        st.success("✅ Fallback st_mermaid render succeeded")
-                                except Exception as e2:
-                                        st.error(f"❌ Fallback render failed: {str(e2)}")
+                # As a last resort, render through an HTML component using the Mermaid CDN
+                try:
+                    st.info("Attempting fallback with the Mermaid CDN...")
+                    import streamlit.components.v1 as components
+                    # Use a wrapper div id so multiple diagrams don't clash
+                    wrapper_id = f"{unique_key}_wrap"
+                    html = _MERMAID_HTML_TMPL.format(wrapper_id=wrapper_id, diagram=diagram_clean)
+
+                    components.html(html, height=420, scrolling=True)
+                    st.success("✅ Fallback CDN render succeeded")
+                except Exception as e2:
+                    st.error(f"❌ Fallback render failed: {str(e2)}")
         
         st.markdown("---")
 
-# ==================== HOME PAGE ====================
-if st.session_state.active_page == "🏠 Accueil":
-    st.title("🏠 Home - AI Study Planner")
-    st.markdown("Your intelligent study planning assistant powered by Gemini 2.5 Flash")
+    return diagrams
+
+# ==================== SIDEBAR ====================
+@st.fragment
+def _render_settings():
+    """Sidebar settings, rerun on their own so edits don't replay the chat."""
+    st.header("⚙️ Study Settings")
+    st.markdown("---")
     
+    study_field = st.text_input(
+        "Study Field/Topic",
+        value=st.session_state.settings.get("study_field", ""),
+        placeholder="e.g., Python, Machine Learning, Java",
+        help="Enter the subject you want to study"
+    )
+    
+    current_level = st.selectbox(
+        "Current Level",
+        _LEVELS,
+        index=_LEVEL_INDEX.get(st.session_state.settings.get("current_level", "Beginner"), 0),
+        help="Select your current proficiency level"
+    )
+    
+    duration = st.selectbox(
+        "Study Duration",
+        _DURATIONS,
+        index=_DURATION_INDEX.get(st.session_state.settings.get("duration", "3 weeks"), len(_DURATIONS) - 1),
+        help="Select your desired study timeline"
+    )
+    
+    if duration == "Custom":
+        custom_duration = st.text_input(
+            "Custom Duration",
+            placeholder="e.g., 5 weeks, 10 days",
+            help="Enter a custom duration"
+        )
+        if custom_duration:
+            duration = custom_duration
+    
+    st.session_state.settings = {
+        "duration": duration,
+        "current_level": current_level,
+        "study_field": study_field
+    }
+    
+    
+  
+    
+    if st.button("🔄 Reset Conversation", use_container_width=True, help="Reset conversation"):
+        st.session_state.gemini_client.reset_conversation()
+        st.session_state.last_raw_response = None
+        st.session_state.messages = []
+        st.session_state.user_count = 0
+        st.session_state.diagrams_count = 0
+        _save_session()
+        st.rerun()
+
+    if st.button("🔧 Render Mermaid Test", use_container_width=True, help="Render a simple test Mermaid diagram to debug rendering"):
+        test_diagram = """graph TD
+    A[Test Start] --> B[Test End]
+    style A fill:#4d94ff
+    style B fill:#33cc33"""
+        display_message(test_diagram)
+    
+    st.markdown("---")
+    st.caption("💡 **Tip:** Set your study preferences before asking for a plan!")
+
+with st.sidebar:
+    _render_settings()
+
+# ==================== HOME PAGE ====================
+@st.fragment
+def _render_chat():
+    """Stats, chat history and input, rerun on their own so chatting doesn't replay the page."""
     # Quick stats
     if st.session_state.messages:
-        user_messages = [msg for msg in st.session_state.messages if msg["role"] == "user"]
-        assistant_messages = [msg for msg in st.session_state.messages if msg["role"] == "assistant"]
-        diagrams_count = sum(1 for msg in assistant_messages if extract_mermaid_diagrams(msg["content"]))
-        
         with st.container():
             cols = st.columns(4)
             with cols[0]:
                 st.metric("Conversations", "1")
             with cols[1]:
-                st.metric("Your Messages", len(user_messages))
+                st.metric("Your Messages", st.session_state.user_count)
             with cols[2]:
-                st.metric("Diagrams", diagrams_count)
+                st.metric("Diagrams", st.session_state.diagrams_count)
             with cols[3]:
                 status = "Active" if st.session_state.gemini_client else "Inactive"
                 st.metric("Status", status)
     
     # Display chat history
     chat_container = st.container()
-    for message in st.session_state.messages:
+    for idx, message in enumerate(st.session_state.messages):
         with chat_container:
             with st.chat_message(message["role"]):
                 if message["role"] == "assistant":
-                    display_message(message["content"])
+                    display_message(message["content"], position=idx)
                 else:
                     st.markdown(message["content"])
     
     # Chat input
     if prompt := st.chat_input("Ask for a study plan or ask questions about your learning journey..."):
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        _add_message("user", prompt)
         
         # Show user message immediately
         with st.chat_message("user"):
@@ -375,37 +554,75 @@ if st.session_state.active_page == "🏠 Accueil":
         
         # Generate and display AI response
         with st.chat_message("assistant"):
-            with st.spinner("🤔 Thinking..."):
-                try:
-                    response = st.session_state.gemini_client.chat(
-                        prompt,
-                        session_id=st.session_state.session_id,
-                        user_settings=st.session_state.settings
-                    )
-                    
-                    # Store the raw response
-                    st.session_state.last_raw_response = response
-                    
-                    # Display the response
-                    display_message(response)
-                    
-                    # Add to messages
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                    
-                    # Save roadmap if valid diagram and DB enabled
+            try:
+                use_cache = not st.session_state.gemini_client.use_database and not _RE_SEARCH_PROMPT.match(prompt)
+                # The messages before this prompt are part of the key, so "shorter" or
+                # "next step" only reuse an answer given after the same conversation
+                cache_key = hashlib.sha1(pickle.dumps(
+                    (prompt, st.session_state.settings, st.session_state.messages[:-1])
+                )).hexdigest()
+                response_cache = st.session_state.response_cache
+                response = response_cache.get(cache_key) if use_cache else None
+                if response is None:
+                    # Stream the text as it arrives; Mermaid blocks are only collected
+                    # and the diagram is drawn once the response is complete.
+                    # No spinner: the streamed text shows progress from the first chunk
+                    placeholder = st.empty()
+                    collected = []
+                    with placeholder.container():
+                        st.write_stream(stream_without_mermaid(
+                            st.session_state.gemini_client.chat_stream(
+                                prompt,
+                                session_id=st.session_state.session_id,
+                                user_settings=st.session_state.settings
+                            ),
+                            collected,
+                            _RE_MERMAID_OPEN
+                        ))
+                    response = "".join(collected).strip()
+                    if use_cache and not response.startswith("Error generating response:"):
+                        response_cache[cache_key] = response
+                        if len(response_cache) > _RESPONSE_CACHE_SIZE:
+                            response_cache.popitem(last=False)
                     diagrams = extract_mermaid_diagrams(response)
-                    if diagrams and st.session_state.gemini_client.use_database:
-                        try:
-                            title = f"Roadmap: {prompt[:50]}..." if len(prompt) > 50 else f"Roadmap: {prompt}"
-                            st.session_state.gemini_client.save_roadmap(title, diagrams[0])
-                            st.toast("✅ Roadmap saved to database!")
-                        except Exception as e:
-                            st.warning(f"Could not save roadmap: {e}")
-                            
-                except Exception as e:
-                    error_msg = f"Error generating response: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                    if diagrams or _RE_MERMAID_OPEN.search(response):
+                        # Swap the streamed text, including any held-back block, for the
+                        # text plus the rendered diagram
+                        placeholder.empty()
+                        display_message(response, position=len(st.session_state.messages))
+                else:
+                    response_cache.move_to_end(cache_key)
+                    # Keep the model's history in step with what the user sees
+                    st.session_state.gemini_client.record_turn(prompt, response)
+                    diagrams = display_message(response, position=len(st.session_state.messages))
+                
+                # Store the raw response
+                st.session_state.last_raw_response = response
+                
+                # Add to messages
+                _add_message("assistant", response)
+                
+                # Save roadmap if valid diagram and DB enabled
+                if diagrams and st.session_state.gemini_client.use_database:
+                    try:
+                        title = f"Roadmap: {prompt[:50]}..." if len(prompt) > 50 else f"Roadmap: {prompt}"
+                        st.session_state.gemini_client.save_roadmap(title, diagrams[0])
+                        st.toast("✅ Roadmap saved to database!")
+                    except Exception as e:
+                        st.warning(f"Could not save roadmap: {e}")
+                        
+            except Exception as e:
+                error_msg = f"Error generating response: {str(e)}"
+                st.error(error_msg)
+                _add_message("assistant", error_msg)
+
+        _save_session()
+
+if st.session_state.active_page == "🏠 Accueil":
+    st.title("🏠 Home - AI Study Planner")
+    st.markdown("Your intelligent study planning assistant powered by Gemini 2.5 Flash")
+    
+    _render_chat()
 
 # ==================== PROGRESS TRACKING PAGE ====================
 elif st.session_state.active_page == "📊 Progress Tracking":
@@ -5,10 +5,16 @@
 CREATE TABLE IF NOT EXISTS conversations (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
     session_id TEXT NOT NULL,
+    summary TEXT, -- Rolling summary of the turns older than the chat window
+    summary_message_count INTEGER DEFAULT 0, -- Number of messages covered by summary
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Added after the initial release; brings existing databases up to date
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_message_count INTEGER DEFAULT 0;
+
 -- Create messages table
 CREATE TABLE IF NOT EXISTS messages (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -42,11 +48,42 @@ CREATE TABLE IF NOT EXISTS roadmap_items (
 
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_conversations_session_id ON conversations(session_id);
+-- One conversation per session; lets SupabaseDB upsert on session_id in one round-trip.
+-- On an existing database, remove duplicate session_id rows before running this.
+CREATE UNIQUE INDEX IF NOT EXISTS conversations_session_id_idx ON conversations(session_id);
 CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
 CREATE INDEX IF NOT EXISTS idx_roadmaps_conversation_id ON roadmaps(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_roadmap_items_roadmap_id ON roadmap_items(roadmap_id);
 
+-- Save a roadmap and its items in one call (used by SupabaseDB.save_roadmap)
+-- p_items is a JSON array of {"id": ..., "title": ..., "description": ...}
+CREATE OR REPLACE FUNCTION save_roadmap_with_items(
+    p_conversation_id UUID,
+    p_title TEXT,
+    p_diagram TEXT,
+    p_items JSONB
+) RETURNS UUID AS $$
+DECLARE
+    v_roadmap_id UUID;
+BEGIN
+    INSERT INTO roadmaps (conversation_id, title, mermaid_diagram)
+    VALUES (p_conversation_id, p_title, p_diagram)
+    RETURNING id INTO v_roadmap_id;
+
+    INSERT INTO roadmap_items (roadmap_id, item_id, title, description, completed)
+    SELECT v_roadmap_id,
+           item->>'id',
+           COALESCE(item->>'title', ''),
+           item->>'description',
+           FALSE
+    FROM jsonb_array_elements(COALESCE(p_items, '[]'::jsonb)) AS item
+    ON CONFLICT (roadmap_id, item_id) DO NOTHING;
+
+    RETURN v_roadmap_id;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Enable Row Level Security (RLS) - Optional, adjust based on your needs
 ALTER TABLE conversations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE messages ENABLE ROW LEVEL SECURITY;